@@ -6,6 +6,7 @@ module.require("aiohttp_cors")
 
 dream_textures = bpy.data.texts["dream_textures.py"].as_module()
 utils = bpy.data.texts["utils.py"].as_module()
+scene_index = bpy.data.texts["scene_index.py"].as_module()
 
 PROCESS_TIMEOUT = 60.0
 
@@ -23,7 +24,7 @@ async def version(request):
     return web.Response(text=version)
 
 async def objects(request):
-    obj_list = [{"name": obj.name, "id": obj.as_pointer(), "type": obj.type} for obj in bpy.data.objects]
+    obj_list = list(scene_index.get_scene_index().objects.values())
     return web.json_response({"objects": obj_list})
 
 async def object(request):
@@ -47,15 +48,16 @@ async def collections(request):
 
 async def collection_objects(request):
     collection_name = request.match_info.get('collection_name')
-    collection = bpy.data.collections.get(collection_name)
-    if collection:
-        obj_list = [{"name": obj.name, "id": obj.as_pointer(), "type": obj.type} for obj in collection.objects]
+    index = scene_index.get_scene_index()
+    names = index.collection_objects(collection_name)
+    if names is not None:
+        obj_list = [index.objects[name] for name in names if name in index.objects]
         return web.json_response({"objects": obj_list})
     else:
         return web.json_response({"error": f"Collection '{collection_name}' not found"}, status=404)
     
 async def materials(request):
-    material_list = [{"name": mat.name, "id": mat.as_pointer()} for mat in bpy.data.materials]
+    material_list = scene_index.get_scene_index().material_list()
     return web.json_response({"materials": material_list})
 
 async def material(request):
@@ -99,7 +101,9 @@ async def run_script(request):
         return web.json_response({"error": f"Text '{script_name}' not found"}, status=404)
 
 async def generate_texture(request):
-    dream_textures.run_process()
+    if not dream_textures.run_process():
+        # A timed out request's queue is still generating: a retry has to wait for it
+        return web.json_response({"error": "DreamTextures is still running"}, status=409)
     elapsed_time = 0
     while elapsed_time < PROCESS_TIMEOUT and not bpy.context.scene.dream_texture_settings.done:
         print("[Request: DreamTextures] In progress...")
@@ -1,8 +1,61 @@
 import bpy
+import os
+import json
+import time
 import queue
+import re
+import random
+import hashlib
+import tracemalloc
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 smap = bpy.data.texts["segmentation_map.py"].as_module()
 utils = bpy.data.texts["utils.py"].as_module()
+image_cache = bpy.data.texts["image_cache.py"].as_module()
+texture_journal = bpy.data.texts["texture_journal.py"].as_module()
+texture_backends = bpy.data.texts["texture_backends.py"].as_module()
+
+TEXTURE_CACHE_BYTES = 4 * 1024 ** 3 # disk budget for generated textures (LRU), 0 to disable the cache
+# dream_textures_prompt properties that change the generated image
+GENERATION_PARAMETERS = ("model", "prompt_structure", "prompt_structure_token_subject", "use_negative_prompt", "negative_prompt",
+                         "seed", "steps", "cfg_scale", "scheduler", "seamless_axes", "width", "height")
+
+POLL_MIN = 0.05 # seconds before the first check for a result; doubles while the generation runs
+POLL_MAX = 1.0  # slowest fallback poll, the depsgraph handler normally wakes the queue first
+NAMESPACE_KEY = "dream_task_manager" # bpy.app.driver_namespace key of the running queue, for the depsgraph handler
+TASK_ORDER = "AREA" # "AREA": materials covering the largest surface first, "SCENE": scene order
+PRIORITY_PROPERTY = "texture_priority" # custom property on a material; higher values go first, whatever TASK_ORDER says
+# Consecutive tasks (in priority order) with the same model, prompt, ControlNet setting and size go to the generator as one call;
+# only the WORKER backend runs a batch in one call. Model, prompt and ControlNet are also set only when they change
+BATCH_GENERATION = True
+TEXTURE_BATCH = 4 # most tasks in one generator call
+ADOPT_OUTPUT_IMAGE = True # rename "DreamTexture Output" to the material's texture instead of copying its pixels into a new image
+BACKGROUND_WRITES = True # write cached results to disk on a background thread while the next generation runs
+JOURNAL_DIR = "texture_journal" # folder next to the .blend recording finished materials so a rerun resumes, "" to disable
+TEXTURE_BACKEND = "DREAM_TEXTURES" # "DREAM_TEXTURES": the add-on operator, "WORKER": texture_worker.py processes, "STUB": CPU test textures
+TEXTURE_WORKERS = 2 # worker processes (each one loads the model) when TEXTURE_BACKEND is "WORKER"
+
+# Progressive mode: a fast preview for every material first, full quality only for the approved ones (upgrade_textures)
+PROGRESSIVE = False
+PREVIEW_SIZE = 256 # largest preview texture, in pixels
+PREVIEW_STEPS = 6
+TIER_PROPERTY = "texture_tier" # material custom property: "PREVIEW" or "FULL", the quality of its current texture
+SEED_PROPERTY = "texture_seed" # material custom property: seed of its texture, reused when it is upgraded
+APPROVED_PROPERTY = "texture_approved" # material custom property set by artists: upgrade_textures() regenerates it at full quality
+TEXTURE_NODE = "Dream Texture" # image node holding the generated texture; an upgrade swaps its image
+
+# Tileable objects ("Tileable Objects" collection) of the same class (utils.TILEABLE_KEYWORDS) and material share one seamless texture
+SHARE_TILEABLE_TEXTURES = True
+TILEABLE_CLASS_FALLBACK = "tileable" # class of a tileable object whose name has no keyword (it was tileable by its file name)
+
+CONTROL_NET_MODEL = 'models--lllyasviel--control_v11p_sd15_seg'
+CONTROL_PROMPT = "a (realistic:1.0) style texture, (concrete: 0.2), (damaged: 1.0), (wood:0.8), octane render, unreal engine, redshift render"
+PLAIN_PROMPT = "a (realistic:1.0) style texture, (small texture:0.5), (wood texture:0.5), (old:0.5), octane render, unreal engine, redshift render"
+TILEABLE_PROMPT = "a (realistic:1.0) style seamless {} texture, (old:0.5), octane render, unreal engine, redshift render"
+
+texture_cache = None
+pixel_buffer = None # float32 buffer reused by every pixel copy, grown as needed
 
 class DreamTexturesSettings(bpy.types.PropertyGroup):
     model: bpy.props.StringProperty(name="Model", default="v1-5-pruned-emaonly")
@@ -12,18 +65,167 @@ class DreamTexturesSettings(bpy.types.PropertyGroup):
     steps: bpy.props.IntProperty(name="Steps", default= 15)
     cfg_scale: bpy.props.IntProperty(name="CFG Scale", default=7)
     scheduler: bpy.props.StringProperty(name="Scheduler", default="KDPM2 Ancestral Discrete")
+    min_size: bpy.props.IntProperty(name="Min Size", default=256)
+    max_size: bpy.props.IntProperty(name="Max Size", default=768)
     started: bpy.props.BoolProperty(name="Started", default=False)
     in_process: bpy.props.BoolProperty(name="InProcess", default=False)
     done: bpy.props.BoolProperty(name="Status", default=False)
 
 
 class DreamTaskManager:
-    def __init__(self):
-        self.current_material = None
+    def __init__(self, on_done=None, tier="FULL", journal_scope=None):
+        self.tier = tier
+        self.backend = texture_backends.get_backend(TEXTURE_BACKEND, TEXTURE_WORKERS, TEXTURE_BATCH if BATCH_GENERATION else 1)
+        self.in_flight = {} # task id -> material, cache key, journal signature, parameters and batch of a running generation
+        self.next_task = 0
+        self.batch = [] # (task id, params, control image) collected for the next submit_batch
+        self.batches = 0
+        self.on_done = on_done
+        self.tick = None
+        self.poll = POLL_MIN
+        self.started = time.perf_counter()
+        self.timings = [] # (material name, generation seconds, link seconds)
+        self.total = 0
+        self.group = None
+        self.groups = 0
+        self.control_hashes = {} # control image name -> pixel hash, computed for the next task while the current one generates
+        self.prepare_time = 0.0
+        self.write_time = 0.0
+        self.writes = []
+        self.journal = texture_journal.TextureJournal(journal_directory(journal_scope)) if JOURNAL_DIR else None
+        self.failed = 0
+        self.replayed = 0
+        self.shared = {} # material name -> other tileable materials of its class that get the same image
+        cache = get_texture_cache()
+        # The cache outlives a run: its counters at the start, so the report shows only this run's hits and misses
+        self.cache_counts = (cache.hits, cache.misses) if cache is not None else (0, 0)
+        saving = cache is not None or self.journal is not None
+        self.writer = ThreadPoolExecutor(max_workers=1) if BACKGROUND_WRITES and saving else None
 
-# Define a function to generate a texture for a given material using Dream Textures
-def dreamtextures_texture():
-    
+    def wake(self):
+        # Run the queue now instead of waiting for its next poll
+        if self.tick is not None and bpy.app.timers.is_registered(self.tick):
+            bpy.app.timers.unregister(self.tick)
+            bpy.app.timers.register(self.tick, first_interval=0)
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        generation = sum(t[1] for t in self.timings)
+        linking = sum(t[2] for t in self.timings)
+        slots = max(self.backend.slots, 1)
+        print("[DREAM TEXTURES] {} tier: {}/{} tasks ({} groups, {} resumed from the journal, {} failed) in {:.1f}s: generation {:.1f}s on {} slots, linking {:.1f}s".format(
+            self.tier.lower(), len(self.timings) + self.replayed, self.total, self.groups, self.replayed, self.failed, total, generation, slots, linking))
+        if total > 0:
+            print("[DREAM TEXTURES] Occupancy: generator {:.0%}, prepare {:.0%}, finalize {:.0%}, disk writes {:.0%} (background)".format(
+                generation / (total * slots), self.prepare_time / total, linking / total, self.write_time / total))
+
+    def write(self, function, *args):
+        start = time.perf_counter()
+        function(*args)
+        self.write_time += time.perf_counter() - start
+
+    def finish_writes(self):
+        if self.writer is None:
+            return
+        self.writer.shutdown(wait=True)
+        for future in self.writes:
+            if future.exception() is not None:
+                print("[DREAM TEXTURES] Write failed:", future.exception())
+
+# The output image shows up in a depsgraph update: wake the queue instead of letting it poll
+def dream_output_update(scene, depsgraph):
+    task_manager = bpy.app.driver_namespace.get(NAMESPACE_KEY)
+    if task_manager is not None and task_manager.in_flight and bpy.data.images.get(texture_backends.OUTPUT_IMAGE) is not None:
+        task_manager.wake()
+
+def register_output_handler():
+    # Each as_module() creates a new function object: replace any handler left by a previous load
+    handlers = bpy.app.handlers.depsgraph_update_post
+    for handler in [h for h in handlers if getattr(h, "__name__", "") == dream_output_update.__name__]:
+        handlers.remove(handler)
+    handlers.append(dream_output_update)
+
+def unregister_output_handler():
+    handlers = bpy.app.handlers.depsgraph_update_post
+    for handler in [h for h in handlers if getattr(h, "__name__", "") == dream_output_update.__name__]:
+        handlers.remove(handler)
+
+def get_texture_cache():
+    global texture_cache
+    if texture_cache is None and TEXTURE_CACHE_BYTES:
+        cache_path = os.path.join(os.path.dirname(bpy.data.filepath), "texture_cache")
+        texture_cache = image_cache.ImageCache(cache_path, TEXTURE_CACHE_BYTES)
+    return texture_cache
+
+def image_pixels_hash(image):
+    pixels = np.empty(len(image.pixels), dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    digest = hashlib.blake2b(pixels.tobytes(), digest_size=16)
+    digest.update("{}x{}".format(*image.size).encode())
+    return digest.hexdigest()
+
+def control_image_hash(image, control_hashes=None):
+    if control_hashes is None:
+        return image_pixels_hash(image)
+    if image.name not in control_hashes:
+        control_hashes[image.name] = image_pixels_hash(image)
+    return control_hashes[image.name]
+
+# Everything that goes into a generation, control image pixels (as a hash) included
+def generation_params(control_hashes=None):
+    prompt = bpy.context.scene.dream_textures_prompt
+    params = {name: getattr(prompt, name, None) for name in GENERATION_PARAMETERS}
+    params["control_nets"] = [
+        [control_net.control_net, control_net.conditioning_scale, control_image_hash(control_net.control_image, control_hashes) if control_net.control_image else None]
+        for control_net in prompt.control_nets
+    ]
+    # Backends make different images from the same prompt: a stub or worker result must not stand in for the add-on's
+    params["backend"] = [TEXTURE_BACKEND, texture_backends.WORKER_GENERATOR if TEXTURE_BACKEND == "WORKER" else None]
+    return params
+
+def params_hash(params):
+    return hashlib.blake2b(json.dumps(params, sort_keys=True, default=str).encode(), digest_size=20).hexdigest()
+
+# Hash of generation_params; None when the result is not reproducible
+def generation_key(control_hashes=None, params=None):
+    if getattr(bpy.context.scene.dream_textures_prompt, "random_seed", False):
+        return None
+    if params is None:
+        params = generation_params(control_hashes)
+    return params_hash(params)
+
+# Journal signature: the generation_params hash, without the seed when it is random. A rerun only resumes
+# a material whose prompt, model, size and control image did not change
+def journal_signature(params):
+    if getattr(bpy.context.scene.dream_textures_prompt, "random_seed", False):
+        params = {name: value for name, value in params.items() if name != "seed"}
+    return params_hash(params)
+
+# One journal per scope: the asset in watch mode, the .blend otherwise, so equal material names of other files never match
+def journal_directory(scope=None):
+    blend = bpy.data.filepath
+    if scope is None:
+        scope = os.path.splitext(os.path.basename(blend))[0] or "untitled"
+    return os.path.join(os.path.dirname(blend), JOURNAL_DIR, scope)
+
+# Size of the task's texture: previews are capped at PREVIEW_SIZE
+def task_size(obj_name, tier):
+    size = texture_size(obj_name)
+    if tier == "PREVIEW":
+        size = max(64, min(size, PREVIEW_SIZE) // 64 * 64)
+    return size
+
+# Pick the generation size from the object's segmentation map resolution (multiple of 64, within min/max size)
+def texture_size(obj_name):
+    settings = bpy.context.scene.dream_texture_settings
+    obj = bpy.data.objects.get(obj_name)
+    if obj is None or "segmentation_resolution" not in obj:
+        return settings.max_size
+    size = min(max(int(obj["segmentation_resolution"]), settings.min_size), settings.max_size)
+    return max(64, size // 64 * 64)
+
+# Set the Dream Textures prompt from our settings (everything but the size)
+def apply_dream_settings():
     settings = bpy.context.scene.dream_texture_settings
     # Set Dream Textures settings
     bpy.context.scene.dream_textures_prompt.model = settings.model
@@ -34,34 +236,120 @@ def dreamtextures_texture():
     bpy.context.scene.dream_textures_prompt.steps = settings.steps
     bpy.context.scene.dream_textures_prompt.cfg_scale = settings.cfg_scale
     bpy.context.scene.dream_textures_prompt.scheduler = settings.scheduler
-    bpy.context.scene.dream_textures_prompt.width = 768
-    bpy.context.scene.dream_textures_prompt.height = 768
-    
-    # Generate Dream Texture Image 
-    bpy.ops.shade.dream_texture()
-
-def get_image_with_suffix(suffix):
-    images = bpy.data.images
-    for image in images:
-        if image.filepath.lower().endswith(suffix.lower()):
-            return image
-    return None
-def link_texture_to_material(material):
 
-#    obj = bpy.context.active_object     
-    objects = bpy.context.scene.objects
-    dream_image = bpy.data.images["DreamTexture Output"]
-    
-          
-    img = bpy.data.images.new(name=material.name + "_T_New_BaseColor", width=dream_image.size[0], height=dream_image.size[1])
-    
-    img.pixels = dream_image.pixels[:]
-    
-    try:
-        bpy.data.images.remove(bpy.data.images["DreamTexture Output"])
-    except:
-        pass
+# Add or remove the segmentation ControlNet and pick the matching prompt
+def use_control_net(enabled):
+    prompt = bpy.context.scene.dream_textures_prompt
+    if enabled:
+        if not prompt.control_nets:
+            prompt.control_nets.add()
+            prompt.control_nets[0].conditioning_scale = 5
+            prompt.control_nets[0].control_net = CONTROL_NET_MODEL
+        prompt.prompt_structure_token_subject = CONTROL_PROMPT
+    else:
+        if prompt.control_nets:
+            prompt.control_nets.remove(0)
+        prompt.prompt_structure_token_subject = PLAIN_PROMPT
+
+def get_pixel_buffer(length):
+    global pixel_buffer
+    if pixel_buffer is None or len(pixel_buffer) < length:
+        pixel_buffer = np.empty(length, dtype=np.float32)
+    return pixel_buffer[:length]
+
+# Copy through a reused NumPy buffer instead of a Python list of floats
+def copy_image_pixels(source, target):
+    buffer = get_pixel_buffer(len(source.pixels))
+    source.pixels.foreach_get(buffer)
+    target.pixels.foreach_set(buffer)
+
+# Turn the generator output into the material's texture; the output name is free again afterwards
+def take_output_image(dream_image, name):
+    if ADOPT_OUTPUT_IMAGE:
+        dream_image.name = name
+        return dream_image
+
+    img = bpy.data.images.new(name=name, width=dream_image.size[0], height=dream_image.size[1])
+    copy_image_pixels(dream_image, img)
+    bpy.data.images.remove(dream_image)
+    return img
+
+# Time and peak Python memory of the output-to-texture paths, e.g. benchmark_pixel_transfer(768)
+# Each repeat starts from a fresh generator output image (not timed) and ends with the texture linked to an image node
+def benchmark_pixel_transfer(size=768, repeats=5):
+    output_pixels = np.random.default_rng(0).random(size * size * 4, dtype=np.float32)
+    material = bpy.data.materials.new("PixelBenchmark Material")
+    material.use_nodes = True
+    node = material.node_tree.nodes.new(type='ShaderNodeTexImage')
+
+    def slice_copy(output):
+        img = bpy.data.images.new("PixelBenchmark Texture", width=size, height=size)
+        img.pixels = output.pixels[:]
+        bpy.data.images.remove(output)
+        return img
+
+    def buffer_copy(output):
+        img = bpy.data.images.new("PixelBenchmark Texture", width=size, height=size)
+        copy_image_pixels(output, img)
+        bpy.data.images.remove(output)
+        return img
+
+    def adopt(output):
+        output.name = "PixelBenchmark Texture"
+        return output
+
+    results = {}
+    for name, transfer in (("pixels[:]", slice_copy), ("foreach_get/set", buffer_copy), ("adopt", adopt)):
+        elapsed = 0.0
+        tracemalloc.start()
+        for _ in range(repeats):
+            output = bpy.data.images.new(texture_backends.OUTPUT_IMAGE, width=size, height=size, float_buffer=True)
+            output.pixels.foreach_set(output_pixels)
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            node.image = transfer(output)
+            elapsed += time.perf_counter() - start
+            img, node.image = node.image, None
+            bpy.data.images.remove(img)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        elapsed /= repeats
+        results[name] = (elapsed, peak)
+        print("[PIXEL BENCHMARK] {}x{} {}: {:.1f} ms, peak {:.1f} MB".format(size, size, name, elapsed * 1000, peak / 1024 ** 2))
+
+    bpy.data.materials.remove(material)
+    return results
+
+# Save the output to the texture cache and the journal. Only the pixel snapshot happens here when there is a writer thread
+def save_output(task, dream_image, task_manager):
+    cache = get_texture_cache() if task["key"] is not None else None
+    journal = task_manager.journal
+    if cache is None and journal is None:
+        return
+    pixels = np.empty(len(dream_image.pixels), dtype=np.float32)
+    dream_image.pixels.foreach_get(pixels)
+    item = (pixels, dream_image.size[0], dream_image.size[1], dream_image.is_float)
 
+    writes = []
+    if cache is not None:
+        writes.append((cache.store_pixels, task["key"], [item]))
+    if journal is not None:
+        writes.append((journal.record, task["material"].name, task["signature"], task["params"]) + item)
+    for write in writes:
+        if task_manager.writer is None:
+            task_manager.write(*write)
+        else:
+            task_manager.writes.append(task_manager.writer.submit(task_manager.write, *write))
+
+# Reattach a texture finished by an earlier run, unless this material already shows it
+def replay_texture(material, path, signature):
+    if material.get("texture_signature") == signature and material.node_tree is not None and material.node_tree.nodes.get(TEXTURE_NODE) is not None:
+        return
+    img = image_cache.load_pixels_image(path, material.name + "_T_New_BaseColor")
+    img.pack()
+    attach_texture(material, img)
+
+def attach_texture(material, img):
     # Create a new image texture node and link it to the Principled BSDF node
     if material is None:
         print("[DREAM TEXTURES] No active material found.")
@@ -69,82 +357,365 @@ def link_texture_to_material(material):
     
     if material.node_tree is None:
         material.node_tree = bpy.data.node_groups.new(type='ShaderNodeTree', name="NodeTree")
-    image_texture_node = material.node_tree.nodes.new(type='ShaderNodeTexImage')
+    # An upgraded texture replaces the preview in the same node, and takes over its name once the preview is gone
+    image_texture_node = material.node_tree.nodes.get(TEXTURE_NODE)
+    if image_texture_node is None:
+        image_texture_node = material.node_tree.nodes.new(type='ShaderNodeTexImage')
+        image_texture_node.name = TEXTURE_NODE
+    previous = image_texture_node.image
     image_texture_node.image = img
+    if previous is not None and previous != img and previous.users == 0:
+        name = previous.name
+        bpy.data.images.remove(previous)
+        if img.name.rsplit(".", 1)[0] == name:
+            img.name = name
     principled_bsdf = material.node_tree.nodes.get("Principled BSDF")
     
     material.node_tree.links.new(image_texture_node.outputs[0], principled_bsdf.inputs[0])
     bpy.context.scene.dream_texture_settings.in_process = False
 
+# While task N generates: hash the control image of task N+1 so starting it costs nothing
+def prepare_next_task(task_queue, task_manager):
+    if task_queue.empty():
+        return
+    control_image = task_queue.queue[0][3]
+    if control_image is not None and control_image.name not in task_manager.control_hashes:
+        start = time.perf_counter()
+        control_image_hash(control_image, task_manager.control_hashes)
+        task_manager.prepare_time += time.perf_counter() - start
+
+# Link a finished generation to its material; the disk writes go to the writer thread
+def finalize_task(task, dream_image, task_manager):
+    material = task["material"]
+    finalized = time.perf_counter()
+    save_output(task, dream_image, task_manager)
+    attach_texture(material, take_output_image(dream_image, material.name + "_T_New_BaseColor"))
+    mark_texture(material, task)
+    share_texture(material, task, task_manager)
+    # The tasks of a batch share one generator call: each one accounts for its share of it
+    task_manager.timings.append((material.name, (finalized - task["started"]) / task.get("batch_size", 1), time.perf_counter() - finalized))
+
+# What the material's texture now is: its tier, and the seed an upgrade has to reuse
+def mark_texture(material, task):
+    material[TIER_PROPERTY] = task["tier"]
+    material["texture_signature"] = task["signature"]
+    if task["seed"] is not None:
+        material[SEED_PROPERTY] = task["seed"]
+    elif SEED_PROPERTY in material:
+        del material[SEED_PROPERTY] # only a preview keeps its seed for the upgrade
+
+# Tileable materials of the same class show the image datablock of the one that was generated
+def share_texture(material, task, task_manager):
+    members = task_manager.shared.get(material.name, ())
+    if not members:
+        return
+    img = material.node_tree.nodes[TEXTURE_NODE].image
+    for member in members:
+        attach_texture(member, img)
+        mark_texture(member, task)
+
+# Seed of the task: the one its preview used when a preview is upgraded; under a random seed one is drawn here so the upgrade can reuse it.
+# Any other run uses the seed of the settings, so changing it still changes textures that already exist
+def task_seed(material, tier):
+    if tier == "FULL" and material.get(TIER_PROPERTY) == "PREVIEW" and SEED_PROPERTY in material:
+        return str(material[SEED_PROPERTY])
+    if tier == "PREVIEW" and getattr(bpy.context.scene.dream_textures_prompt, "random_seed", False):
+        return str(random.randrange(2 ** 31))
+    return None
+
+# Set the prompt up for the task and hand it to the backend, unless the journal or the cache already has its result
+def start_task(obj_name, material, control_image, task_manager):
+    prompt = bpy.context.scene.dream_textures_prompt
+    random_seed = getattr(prompt, "random_seed", False)
+    seed = task_seed(material, task_manager.tier)
+    if seed is not None:
+        prompt.seed = seed
+        if random_seed:
+            prompt.random_seed = False
+    try:
+        return submit_task(obj_name, material, control_image, task_manager)
+    finally:
+        # The next task in the group must not inherit this material's seed
+        if seed is not None:
+            prompt.seed = bpy.context.scene.dream_texture_settings.seed
+            if random_seed:
+                prompt.random_seed = True
+
+def submit_task(obj_name, material, control_image, task_manager):
+    print(f"Processing... {obj_name} {material.name}")
+    # Model, prompt and ControlNet only change between groups; within a group just the control image and size do
+    group = generation_group(obj_name, control_image)
+    if not BATCH_GENERATION or group != task_manager.group:
+        use_control_net(control_image is not None)
+        apply_dream_settings()
+        if group[2] is not None:
+            bpy.context.scene.dream_textures_prompt.prompt_structure_token_subject = TILEABLE_PROMPT.format(group[2])
+            bpy.context.scene.dream_textures_prompt.seamless_axes = "xy"
+        task_manager.group = group
+        task_manager.groups += 1
+        if task_manager.tier == "PREVIEW":
+            bpy.context.scene.dream_textures_prompt.steps = PREVIEW_STEPS
+    if control_image is not None:
+        bpy.context.scene.dream_textures_prompt.control_nets[0].control_image = control_image
+
+    # Finished by an earlier (crashed or interrupted) run with the same parameters: reattach it and move on
+    size = task_size(obj_name, task_manager.tier)
+    bpy.context.scene.dream_textures_prompt.width = size
+    bpy.context.scene.dream_textures_prompt.height = size
+    params = generation_params(task_manager.control_hashes)
+    key = generation_key(params=params)
+    signature = journal_signature(params)
+    path = task_manager.journal.lookup(material.name, signature) if task_manager.journal else None
+    task = {"material": material, "key": key, "signature": signature, "params": params, "tier": task_manager.tier,
+            "seed": params["seed"] if key is not None and task_manager.tier == "PREVIEW" else None, "started": time.perf_counter()}
+    if path is not None:
+        replay_texture(material, path, signature)
+        mark_texture(material, task)
+        share_texture(material, task, task_manager)
+        task_manager.replayed += 1
+        print("[DREAM TEXTURES] Resumed from journal:", material.name)
+        return
+
+    # Same parameters and control image as an earlier run: that result is the texture, nothing to generate or store
+    cache = get_texture_cache()
+    images = cache.load(key, [material.name + "_T_New_BaseColor"]) if key is not None and cache is not None else None
+    if images is not None:
+        print("[DREAM TEXTURES] Loaded from cache:", key)
+        task["key"] = None
+        finalize_task(task, images[0], task_manager)
+        return
+
+    print("[DREAM TEXTURES] Generating texture for material: {} ({}/{})".format(material.name, len(task_manager.timings) + len(task_manager.in_flight) + 1, task_manager.total))
+    task_id = task_manager.next_task
+    task_manager.next_task += 1
+    task["batch"] = task_manager.batches
+    task_manager.in_flight[task_id] = task
+    task_manager.batch.append((task_id, params, control_image))
+    # A full batch goes out while the prompt still holds this task's settings (the add-on operator reads them)
+    if len(task_manager.batch) >= task_manager.backend.batch_size:
+        submit_batch(task_manager)
+
+def submit_batch(task_manager):
+    if not task_manager.batch:
+        return
+    for task_id, _, _ in task_manager.batch:
+        task_manager.in_flight[task_id]["batch_size"] = len(task_manager.batch)
+    task_manager.backend.submit_batch(task_manager.batch)
+    task_manager.batch = []
+    task_manager.batches += 1
+
+# Tasks can share a generator call when this is the same: the generation group and the texture size
+def batch_key(obj_name, control_image, tier):
+    return generation_group(obj_name, control_image), task_size(obj_name, tier)
+
+def finish_queue(task_manager):
+    bpy.context.scene.dream_texture_settings.done = True
+    unregister_output_handler()
+    bpy.app.driver_namespace.pop(NAMESPACE_KEY, None)
+    task_manager.finish_writes()
+    task_manager.report()
+    cache = get_texture_cache()
+    if cache is not None:
+        stats = cache.stats()
+        hits = stats["hits"] - task_manager.cache_counts[0]
+        misses = stats["misses"] - task_manager.cache_counts[1]
+        print("[DREAM TEXTURES] Cache: {} hits, {} misses ({:.0%}) this run, {} entries, {} bytes".format(
+            hits, misses, hits / (hits + misses) if hits + misses else 0.0, stats["entries"], stats["bytes"]))
+    print("[DREAM TEXTURES] DONE XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX")
+    if task_manager.tier == "PREVIEW":
+        print("[DREAM TEXTURES] Previews ready: set the '{}' property on the materials to keep, then run upgrade_textures()".format(APPROVED_PROPERTY))
+    if task_manager.on_done is not None:
+        task_manager.on_done()
+
 # Define a function to process the texture generation queue
 def process_texture_queue(task_queue, task_manager):
-    print("[DREAM TEXTURES] In progress for material: ", task_manager.current_material)
+    # Finalize every generation the backend finished since the last tick
+    finished = task_manager.backend.poll()
+    for task_id, dream_image in finished:
+        task = task_manager.in_flight.pop(task_id, None)
+        if task is None:
+            continue # a dead worker's task can be reported by both submit() and its reader thread
+        if dream_image is None:
+            task_manager.failed += 1
+            print("[DREAM TEXTURES] No texture for material:", task["material"].name)
+            continue
+        finalize_task(task, dream_image, task_manager)
 
-    if bpy.data.images.get("DreamTexture Output") is not None and task_manager.current_material is not None:
-#        print("[DREAM TEXTURES] Applying texture for material: {}".format(task_manager.current_material.name))
-        link_texture_to_material(task_manager.current_material)
-        return 1
-    
-    # Process the next texture generation task in the queue
-    if not bpy.context.scene.dream_texture_settings.in_process:
-        if not task_queue.empty():
-            if not bpy.context.scene.dream_textures_prompt.control_nets:
-                bpy.context.scene.dream_textures_prompt.control_nets.add()
-                bpy.context.scene.dream_textures_prompt.control_nets[0].conditioning_scale = 5
-                bpy.context.scene.dream_textures_prompt.control_nets[0].control_net = 'models--lllyasviel--control_v11p_sd15_seg'
-
-            obj_name, material, i = task_queue.get()
-            print(f"Processing... {obj_name} {material.name}")
-            if material is not None:      
-                image_name = f"{obj_name}_{i}_T_SegmentationMap"
-                if bpy.data.images.get(image_name) is None and bpy.context.scene.dream_textures_prompt.control_nets:
-                    bpy.context.scene.dream_textures_prompt.control_nets.remove(0)
-                    bpy.context.scene.dream_textures_prompt.prompt_structure_token_subject = "a (realistic:1.0) style texture, (small texture:0.5), (wood texture:0.5), (old:0.5), octane render, unreal engine, redshift render"
-
-                else:
-                    bpy.context.scene.dream_textures_prompt.control_nets[0].control_image = bpy.data.images[image_name]
-                    bpy.context.scene.dream_textures_prompt.prompt_structure_token_subject = "a (realistic:1.0) style texture, (concrete: 0.2), (damaged: 1.0), (wood:0.8), octane render, unreal engine, redshift render"
-
-                bpy.context.scene.dream_texture_settings.in_process = True
-                task_manager.current_material = material
-                print("[DREAM TEXTURES] Generating texture for material: {}".format(material.name))
-                dreamtextures_texture()
-        else:
-            bpy.context.scene.dream_texture_settings.done = True
-            print("[DREAM TEXTURES] DONE XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX")
-            # All texture generation tasks are complete, unregister the timer
-            return None
+    # Fill every free backend slot with a batch of consecutive tasks that can share a call; journal and cache hits
+    # finish right here and take no room in the batch
+    started = 0
+    while len(set(task["batch"] for task in task_manager.in_flight.values())) < task_manager.backend.slots and not task_queue.empty():
+        batches = task_manager.batches
+        key = None
+        while not task_queue.empty() and task_manager.batches == batches:
+            obj_name, material, i, control_image = task_queue.queue[0]
+            next_key = batch_key(obj_name, control_image, task_manager.tier) if material is not None else key
+            if task_manager.batch and next_key != key:
+                break
+            key = next_key
+            task_queue.get()
+            if material is not None:
+                start_task(obj_name, material, control_image, task_manager)
+                started += 1
+        submit_batch(task_manager)
+    bpy.context.scene.dream_texture_settings.in_process = bool(task_manager.in_flight)
+
+    if not task_manager.in_flight and task_queue.empty():
+        finish_queue(task_manager)
+        # All texture generation tasks are complete, unregister the timer
+        return None
+    if task_manager.backend.slots == 0:
+        # Every worker died: what is left can not run, nor will the running generations come back
+        task_manager.failed += task_queue.qsize() + len(task_manager.in_flight)
+        while not task_queue.empty():
+            task_queue.get()
+        task_manager.in_flight.clear()
+        print("[DREAM TEXTURES] No texture backend left")
+        bpy.context.scene.dream_texture_settings.in_process = False
+        finish_queue(task_manager)
+        return None
+
+    if finished or started:
+        prepare_next_task(task_queue, task_manager)
+        task_manager.poll = POLL_MIN
+        return task_manager.poll
+
+    # Still generating: back off towards POLL_MAX, the depsgraph handler wakes the queue when the output appears
+    task_manager.poll = min(task_manager.poll * 2, POLL_MAX)
+    return task_manager.poll
+
+# Surface area covered by each material slot of the mesh
+def material_areas(mesh):
+    areas = np.empty(len(mesh.polygons), dtype=np.float32)
+    mesh.polygons.foreach_get("area", areas)
+    indices = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("material_index", indices)
+    return np.bincount(indices, weights=areas, minlength=len(mesh.materials))
+
+# One task per material, in priority order. A material's texture is shared by every object using it,
+# so its control image comes from the object where it covers the most surface
+def plan_texture_tasks(objects):
+    tasks = {} # material name -> task
+    mesh_areas = {}
+    for obj in objects:
+        if obj.type != 'MESH':
+            continue
+        if obj.data.name not in mesh_areas:
+            mesh_areas[obj.data.name] = material_areas(obj.data)
+        areas = mesh_areas[obj.data.name]
+
+        for i, material in enumerate(obj.data.materials, start=1):
+            if material is None:
+                continue
+            area = float(areas[i - 1]) if i - 1 < len(areas) else 0.0
+            task = tasks.get(material.name)
+            if task is None:
+                task = tasks[material.name] = {"obj_name": obj.name, "material": material, "index": i, "area": 0.0, "best_area": area}
+            elif area > task["best_area"]:
+                task.update(obj_name=obj.name, index=i, best_area=area)
+            task["area"] += area
+
+    ordered = list(tasks.values())
+    if TASK_ORDER == "AREA":
+        ordered.sort(key=lambda task: task["area"], reverse=True)
+    ordered.sort(key=lambda task: task["material"].get(PRIORITY_PROPERTY, 0), reverse=True) # stable: keeps the area order within a priority
+    return [(task["obj_name"], task["material"], task["index"]) for task in ordered]
 
-    # Return a value greater than zero to keep the timer running
-    return 1
+# Tasks with the same group can run back to back without touching the model, prompt or ControlNet
+def generation_group(obj_name, control_image):
+    tile_class = tileable_class(obj_name) if SHARE_TILEABLE_TEXTURES else None
+    return (bpy.context.scene.dream_texture_settings.model, control_image is not None, tile_class)
+
+# Keyword class of an object in "Tileable Objects" ("wall", "floor"...), None for any other object
+def tileable_class(obj_name):
+    obj = bpy.data.objects.get(obj_name)
+    if obj is None or not any(collection.name == "Tileable Objects" for collection in obj.users_collection):
+        return None
+    return next((keyword for keyword in utils.TILEABLE_KEYWORDS if keyword in obj.name.lower()), TILEABLE_CLASS_FALLBACK)
+
+# Same material once Blender's ".001" suffixes are dropped; the per-object placeholders segmentation_map gives tileables are all one material
+def material_family(material):
+    if material.name.startswith("Material_"):
+        return ""
+    return re.sub(r"\.\d{3}$", "", material.name)
+
+# One task per tileable class and material family, in the position of its first (highest priority) member; shared: kept material -> the others
+def share_tileable_tasks(tasks):
+    kept = {}
+    shared = {}
+    result = []
+    for obj_name, material, i in tasks:
+        tile_class = tileable_class(obj_name)
+        if tile_class is None:
+            result.append((obj_name, material, i))
+            continue
+        key = (tile_class, material_family(material))
+        if key in kept:
+            shared.setdefault(kept[key], []).append(material)
+            continue
+        kept[key] = material.name
+        result.append((obj_name, material, i))
+    return result, shared
 
 # Define a function to generate textures for all materials in the active object
-def generate_textures_for_all_materials():
+# tier: "PREVIEW" (small and few steps) or "FULL", PROGRESSIVE picks it by default; materials: only these material names;
+# journal_scope: journal folder of these objects, the .blend file name by default
+def generate_textures_for_all_materials(objects=None, on_done=None, tier=None, materials=None, journal_scope=None):
+    # One queue at a time: a second one would share the backend's task ids and the output image with the first.
+    # Returns False when a queue is still running (a timed out request keeps generating), True once this one is started
+    if texture_queue_running():
+        print("[DREAM TEXTURES] A texture queue is still running, not starting another")
+        return False
+    bpy.context.scene.dream_texture_settings.done = False
     try:
-        bpy.data.images.remove(bpy.data.images["DreamTexture Output"])
+        bpy.data.images.remove(bpy.data.images[texture_backends.OUTPUT_IMAGE])
     except:
         pass
-    objects = bpy.context.scene.objects
+    if objects is None:
+        objects = bpy.context.scene.objects
     # Create a queue to hold the texture generation tasks
     task_queue = queue.Queue()
-    task_manager = DreamTaskManager()
-    i = 0
-    
-    for obj in objects:
-        print(obj.name)
-        if obj.type == 'MESH':
-            materials = obj.data.materials
-            
-            print(obj.name)
+    task_manager = DreamTaskManager(on_done, tier or ("PREVIEW" if PROGRESSIVE else "FULL"), journal_scope)
 
-            # Add each material and Dream Textures settings to the queue
-            for i, material in enumerate(materials, start=1):
+    # Add each material and Dream Textures settings to the queue; a preview never replaces a full quality texture
+    planned = [(obj_name, material, i) for obj_name, material, i in plan_texture_tasks(objects)
+               if (materials is None or material.name in materials) and not (task_manager.tier == "PREVIEW" and material.get(TIER_PROPERTY) == "FULL")]
+    if SHARE_TILEABLE_TEXTURES:
+        planned, task_manager.shared = share_tileable_tasks(planned)
+        members = sum(len(group) for group in task_manager.shared.values())
+        if members:
+            print("[DREAM TEXTURES] {} tileable materials share the texture of {} others".format(members, len(task_manager.shared)))
+    tasks = [(obj_name, material, i, smap.get_segmentation_image(obj_name, i)) for obj_name, material, i in planned]
+    for task in tasks:
+        task_queue.put(task)
+        print("[DREAM TEXTURES] Adding to queue:", task[1].name, "from", task[0])
+    task_manager.total = task_queue.qsize()
+    print("[DREAM TEXTURES] {} unique materials to generate".format(task_manager.total))
 
-                task_queue.put((obj.name, material,i))
-                print("[DREAM TEXTURES] Adding to queue:", material.name)
-                # Register a timer to process the texture genernation queue
-    bpy.app.timers.register(lambda: process_texture_queue(task_queue, task_manager))
-    # task_queue.put((None, None, None))
+    # Register a timer to process the texture genernation queue
+    task_manager.tick = lambda: process_texture_queue(task_queue, task_manager)
+    bpy.app.driver_namespace[NAMESPACE_KEY] = task_manager
+    register_output_handler()
+    bpy.app.timers.register(task_manager.tick)
+    return True
+
+# False once the queue finished, or when its timer died (an exception in a tick unregisters it)
+def texture_queue_running():
+    task_manager = bpy.app.driver_namespace.get(NAMESPACE_KEY)
+    return task_manager is not None and task_manager.tick is not None and bpy.app.timers.is_registered(task_manager.tick)
+
+# Drop a stalled or dead queue: its timer, its handler and its backend, whose late results must not reach the next queue
+def stop_texture_queue():
+    task_manager = bpy.app.driver_namespace.pop(NAMESPACE_KEY, None)
+    if task_manager is None:
+        return
+    if task_manager.tick is not None and bpy.app.timers.is_registered(task_manager.tick):
+        bpy.app.timers.unregister(task_manager.tick)
+    unregister_output_handler()
+    task_manager.finish_writes()
+    texture_backends.close_backend()
+    bpy.context.scene.dream_texture_settings.in_process = False
+    print("[DREAM TEXTURES] Texture queue stopped")
 
 def register_dream_texture_settings():
     try:
@@ -158,8 +729,15 @@ def register_dream_texture_settings():
     bpy.context.scene.dream_texture_settings.in_process = False
     bpy.context.scene.dream_texture_settings.done = False
 
-def run_process():
-    generate_textures_for_all_materials()
+# Second pass of the progressive mode: full quality for the approved (or the given) materials, same seed and control image as their preview
+def upgrade_textures(objects=None, on_done=None, materials=None, journal_scope=None):
+    if materials is None:
+        materials = [material.name for material in bpy.data.materials if material.get(APPROVED_PROPERTY) and material.get(TIER_PROPERTY) != "FULL"]
+    print("[DREAM TEXTURES] Upgrading {} materials to full quality".format(len(materials)))
+    return generate_textures_for_all_materials(objects, on_done, tier="FULL", materials=set(materials), journal_scope=journal_scope)
+
+def run_process(on_done=None):
+    return generate_textures_for_all_materials(on_done=on_done)
     
 if __name__ == "__main__":
     tile_collection, imported_collection= utils.import_gltf_files("C:/Users/Vertex Studio/Desktop/2023/250523/microverse-component-library-v0.0.2/archive_temp//") 
@@ -0,0 +1,119 @@
+import os
+import json
+import shutil
+import struct
+
+# Pre-scan of GLTF/GLB files without bpy: only the JSON part is read (the GLB binary chunk is skipped)
+
+GLB_MAGIC = b"glTF"
+GLB_CHUNK_JSON = 0x4E4F534A # "JSON" en little-endian
+
+COMPONENT_SIZES = {5120: 1, 5121: 1, 5122: 2, 5123: 2, 5125: 4, 5126: 4} # bytes por componente según "componentType"
+TYPE_COMPONENTS = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4, "MAT2": 4, "MAT3": 9, "MAT4": 16}
+
+def read_gltf_json(path): #! devuelve el JSON de un .gltf, o el del primer chunk de un .glb, sin leer los buffers binarios.
+    with open(path, "rb") as f:
+        if not path.lower().endswith(".glb"):
+            return json.loads(f.read().decode("utf-8"))
+
+        magic, version, length = struct.unpack("<4sII", f.read(12))
+        if magic != GLB_MAGIC:
+            raise ValueError("not a GLB file")
+        if version != 2:
+            raise ValueError("unsupported GLB version {}".format(version))
+        chunk_length, chunk_type = struct.unpack("<II", f.read(8))
+        if chunk_type != GLB_CHUNK_JSON:
+            raise ValueError("first GLB chunk is not JSON")
+        chunk = f.read(chunk_length)
+        if len(chunk) != chunk_length or 20 + chunk_length > length:
+            raise ValueError("truncated GLB file")
+        return json.loads(chunk.decode("utf-8"))
+
+def accessor_count(accessors, index): #! cantidad de elementos del accessor "index", validando que exista.
+    if not isinstance(index, int) or not 0 <= index < len(accessors):
+        raise ValueError("accessor index {} out of range".format(index))
+    return accessors[index].get("count", 0)
+
+def scan_file(path, keywords=()): #! reporte de un archivo: nombres de nodos, mallas, primitivas, caras, tamaño de accessors, materiales y texturas, y si es "tileable" según "keywords".
+    name = os.path.basename(path)
+    report = {
+        "file": name,
+        "path": path,
+        "size": 0,
+        "ok": True,
+        "error": None,
+        "nodes": [],
+        "meshes": 0,
+        "primitives": 0,
+        "vertices": 0,
+        "faces": 0,
+        "accessor_bytes": 0,
+        "materials": 0,
+        "textures": 0,
+        "images": 0,
+        "tileable": False,
+        "keywords": list(keywords),
+        "tileable_nodes": [],
+        "cost": 0,
+    }
+
+    try:
+        report["size"] = os.path.getsize(path) # dentro del try: el archivo puede desaparecer entre el listado y el escaneo
+        gltf = read_gltf_json(path)
+        if not str(gltf.get("asset", {}).get("version", "")).startswith("2"):
+            raise ValueError("unsupported glTF version")
+
+        accessors = gltf.get("accessors", [])
+        for accessor in accessors:
+            components = TYPE_COMPONENTS.get(accessor.get("type"), 1)
+            report["accessor_bytes"] += accessor.get("count", 0) * components * COMPONENT_SIZES.get(accessor.get("componentType"), 4)
+
+        for mesh in gltf.get("meshes", []):
+            report["meshes"] += 1
+            for primitive in mesh.get("primitives", []):
+                report["primitives"] += 1
+                vertices = accessor_count(accessors, primitive.get("attributes", {}).get("POSITION"))
+                report["vertices"] += vertices
+                indices = accessor_count(accessors, primitive["indices"]) if "indices" in primitive else vertices
+                mode = primitive.get("mode", 4)
+                if mode == 4: # TRIANGLES
+                    report["faces"] += indices // 3
+                elif mode in (5, 6): # TRIANGLE_STRIP, TRIANGLE_FAN
+                    report["faces"] += max(indices - 2, 0)
+
+        report["nodes"] = [node.get("name", "") for node in gltf.get("nodes", [])]
+        report["materials"] = len(gltf.get("materials", []))
+        report["textures"] = len(gltf.get("textures", []))
+        report["images"] = len(gltf.get("images", []))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError, struct.error, UnicodeDecodeError) as e:
+        report["ok"] = False
+        report["error"] = str(e)
+        return report
+
+    report["tileable_nodes"] = [node for node in report["nodes"] if any(keyword in node.lower() for keyword in keywords)]
+    report["tileable"] = any(keyword in name.lower() for keyword in keywords) or bool(report["tileable_nodes"])
+    # Rough import cost: geometry to convert plus one unit per material/texture set up
+    report["cost"] = report["vertices"] + report["faces"] + 1000 * (report["materials"] + report["textures"])
+    return report
+
+def import_tileable(report): #! clasificación de los objetos del archivo para la importación: True (todos son "tileable", por el nombre del archivo), False (ninguno) o None (se decide objeto por objeto).
+    if any(keyword in report["file"].lower() for keyword in report["keywords"]):
+        return True
+    return None if report["tileable_nodes"] else False
+
+def scan_directory(directory, keywords=()): #! reporta todos los .gltf/.glb del directorio.
+    files = sorted(file for file in os.listdir(directory) if file.lower().endswith((".gltf", ".glb")))
+    return [scan_file(os.path.join(directory, file), keywords) for file in files]
+
+def plan_imports(reports): #! separa los archivos válidos (ordenados del más costoso al menos costoso) de los que no se pueden importar.
+    good = sorted((report for report in reports if report["ok"]), key=lambda report: report["cost"], reverse=True)
+    bad = [report for report in reports if not report["ok"]]
+    return good, bad
+
+def quarantine(reports, directory, folder="quarantine"): #! mueve los archivos con error a una subcarpeta para no volver a intentarlos.
+    quarantine_dir = os.path.join(directory, folder)
+    if reports and not os.path.exists(quarantine_dir):
+        os.makedirs(quarantine_dir)
+    for report in reports:
+        shutil.move(report["path"], os.path.join(quarantine_dir, report["file"]))
+        print("[GLTF SCAN] Quarantined {}: {}".format(report["file"], report["error"]))
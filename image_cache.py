@@ -0,0 +1,178 @@
+import bpy
+import os
+import json
+import time
+import zlib
+import struct
+import threading
+import numpy as np
+
+INDEX_FILE = "index.json"
+FLOAT_SUFFIX = ".float.npy" # raw pixels of a float image; byte images are stored as PNG (".npy" files of older runs still load)
+PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6} # channels -> PNG color type
+
+def save_image_copy(image, path):
+    # Save a copy so the original keeps its name, filepath and packed data
+    copy = image.copy()
+    copy.file_format = 'PNG'
+    copy.save(filepath=path)
+    bpy.data.images.remove(copy)
+
+def pixels_file_suffix(is_float):
+    return FLOAT_SUFFIX if is_float else ".png"
+
+def chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+def save_png(path, pixels, width, height):
+    # 8-bit PNG with NumPy and zlib only, so it can run off the main thread. Lossless for a byte image's pixels;
+    # Blender rows are bottom-up, PNG rows top-down
+    rows = pixels.reshape(height, width, -1)[::-1]
+    data = (np.clip(rows, 0.0, 1.0) * 255 + 0.5).astype(np.uint8).reshape(height, -1)
+    raw = np.hstack((np.zeros((height, 1), dtype=np.uint8), data)).tobytes() # filter byte 0 before each row
+    header = struct.pack(">IIBBBBB", width, height, 8, PNG_COLOR_TYPES[rows.shape[2]], 0, 0, 0)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b""))
+
+def save_pixels(path, pixels, width, height):
+    if path.endswith(".png"):
+        save_png(path, pixels, width, height)
+        return
+    with open(path, "wb") as f:
+        np.save(f, pixels.reshape(height, width, -1))
+
+def load_pixels_image(path, name):
+    # Image written by save_pixels or save_image_copy: a PNG, or a (height, width, channels) float32 array
+    if not path.endswith(".npy"):
+        image = bpy.data.images.load(path)
+        image.name = name
+        return image
+    pixels = np.load(path)
+    height, width, channels = pixels.shape
+    image = bpy.data.images.new(name, width=width, height=height, alpha=channels == 4, float_buffer=path.endswith(FLOAT_SUFFIX))
+    image.pixels.foreach_set(pixels.ravel())
+    return image
+
+class ImageCache:
+    """On-disk, content-addressed cache of Blender images with an LRU size cap"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock() # store_pixels may run on a writer thread
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.entries = self.read_index()
+
+    def read_index(self):
+        try:
+            with open(self.index_path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # Drop entries whose files were deleted behind our back
+        return {key: entry for key, entry in entries.items()
+                if all(os.path.exists(os.path.join(self.directory, name)) for name in entry["files"])}
+
+    def write_index(self):
+        with self.lock:
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.index_path)
+
+    def lookup(self, key, count=None):
+        # count: number of files the caller expects; an entry with another number is a miss
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (count is not None and len(entry["files"]) != count):
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_used"] = time.time()
+            self.write_index()
+            return [os.path.join(self.directory, name) for name in entry["files"]]
+
+    def load(self, key, image_names):
+        # Returns the cached images renamed to image_names, or None on a miss.
+        # The lock is held while reading so a background store_pixels cannot evict the files in between
+        with self.lock:
+            paths = self.lookup(key, len(image_names))
+            if paths is None:
+                return None
+            images = []
+            try:
+                for path, name in zip(paths, image_names):
+                    image = load_pixels_image(path, name)
+                    image.pack()
+                    images.append(image)
+            except (OSError, RuntimeError, ValueError) as e:
+                # File deleted or damaged outside the cache: forget the entry and count a miss
+                print("[IMAGE CACHE] Dropping unreadable entry {}: {}".format(key, e))
+                for image in images:
+                    bpy.data.images.remove(image)
+                self.entries.pop(key, None)
+                self.write_index()
+                self.hits -= 1
+                self.misses += 1
+                return None
+            return images
+
+    def store(self, key, images):
+        files = []
+        size = 0
+        for n, image in enumerate(images):
+            name = "{}_{}.png".format(key, n)
+            path = os.path.join(self.directory, name)
+            save_image_copy(image, path)
+            files.append(name)
+            size += os.path.getsize(path)
+
+        self.add_entry(key, files, size)
+
+    def store_pixels(self, key, images):
+        # images: (pixels, width, height, is_float) tuples. No bpy calls, so this can run off the main thread
+        files = []
+        size = 0
+        for n, (pixels, width, height, is_float) in enumerate(images):
+            name = "{}_{}{}".format(key, n, pixels_file_suffix(is_float))
+            path = os.path.join(self.directory, name)
+            save_pixels(path, pixels, width, height)
+            files.append(name)
+            size += os.path.getsize(path)
+
+        self.add_entry(key, files, size)
+
+    def add_entry(self, key, files, size):
+        with self.lock:
+            self.entries[key] = {"files": files, "size": size, "last_used": time.time()}
+            self.evict()
+            self.write_index()
+
+    def evict(self):
+        total = sum(entry["size"] for entry in self.entries.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            entry = self.entries.pop(key)
+            total -= entry["size"]
+            for name in entry["files"]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "entries": len(self.entries),
+                "bytes": sum(entry["size"] for entry in self.entries.values()),
+            }
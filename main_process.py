@@ -1,30 +1,230 @@
 import bpy
+import os
+import time
+import shutil
 
 dream_textures = bpy.data.texts["dream_textures.py"].as_module()
 smap = bpy.data.texts["segmentation_map.py"].as_module()
 utils = bpy.data.texts["utils.py"].as_module()
 
-def process_timer():
-    if not bpy.context.scene.dream_texture_settings.done:
-        if not bpy.context.scene.dream_texture_settings.started:
-            print("[TEXTURE GENERATION] Starting Dream Textures...")
-            bpy.context.scene.dream_texture_settings.started = True
-            dream_textures.run_process()
-        print("[DREAM TEXTURES] Processing...")
-        return 1   
-    
+INPUT_DIR = "C:/Users/Vertex Studio/Desktop/2023/250523/microverse-component-library-v0.0.2/archive_temp//"
+OUTPUT_DIR = "C:/Users/Vertex Studio/Desktop/2023/250523/microverse-component-library-v0.0.2//"
+
+# Watch mode: process each file as it lands in INPUT_DIR instead of importing the whole folder up front
+WATCH_MODE = False
+WATCH_INTERVAL = 2.0        # seconds between polls of the input folder
+MAX_IN_FLIGHT = 2           # assets imported but not yet exported; further files wait on disk until one finishes
+GENERATION_TIMEOUT = 1800.0 # seconds an asset may hold the texture queue before it fails and frees it for the others
+PROCESSED_FOLDER = "processed"
+FAILED_FOLDER = "failed"
+NAMESPACE_KEY = "watch_folder"
+
+STAGES = ("import", "segmentation", "generation", "normals", "export", "release")
+
+def finish_process():
     utils.colortonormals()
-    utils.export("C:/Users/Vertex Studio/Desktop/2023/250523/microverse-component-library-v0.0.2//")
+    utils.export(OUTPUT_DIR)
 
     print("[TEXTURE GENERATION] Done!")
-    return None
 
 def run_process():
-    bpy.app.timers.register(lambda: process_timer())
+    # The texture queue calls finish_process when its last task is linked, no polling here
+    print("[TEXTURE GENERATION] Starting Dream Textures...")
+    bpy.context.scene.dream_texture_settings.started = True
+    dream_textures.run_process(on_done=finish_process)
+
+class StreamAsset:
+    def __init__(self, path):
+        self.path = path
+        self.file = os.path.basename(path)
+        self.stage = 0
+        self.generated = False
+        self.generation_started = None
+        self.file_hash = None
+        self.object_names = []
+        self.started = time.time()
+
+    def objects(self):
+        # Names, not references: merge/join during segmentation can delete objects
+        return [bpy.data.objects[name] for name in self.object_names if name in bpy.data.objects]
+
+class WatchFolder:
+    """Moves each asset through import -> UV/segmentation -> generation -> normals -> export on its own"""
+
+    def __init__(self, input_dir, output_dir, max_in_flight=None):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.max_in_flight = max_in_flight or MAX_IN_FLIGHT
+        self.sizes = {}         # path -> size on the previous poll
+        self.in_flight = []
+        self.texturing = None   # asset holding Dream Textures, from generation until its objects are released
+        self.last_poll = 0.0
+        self.finished = 0
+        self.failed = 0
+        self.stopped = False
+        self.tile_collection, self.imported_collection = utils.get_import_collections()
+
+    def poll(self):
+        self.last_poll = time.time()
+        if len(self.in_flight) >= self.max_in_flight:
+            return # backpressure: leave new files on disk
+
+        busy = set(asset.path for asset in self.in_flight)
+        sizes = {}
+        with os.scandir(self.input_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(('.gltf', '.glb')) and entry.path not in busy:
+                    sizes[entry.path] = entry.stat().st_size
+
+        # A file is taken once its size did not change since the last poll, so half-copied files are skipped
+        ready = sorted(path for path, size in sizes.items() if self.sizes.get(path) == size)
+        self.sizes = sizes
+        for path in ready[:self.max_in_flight - len(self.in_flight)]:
+            self.in_flight.append(StreamAsset(path))
+            print("[WATCH] Queued {} ({} in flight)".format(os.path.basename(path), len(self.in_flight)))
+
+    def advance(self, asset):
+        # Runs at most one stage of the asset; returns False while it has to wait
+        stage = STAGES[asset.stage]
+
+        if stage == "import":
+            gltf_scan = bpy.data.texts["gltf_scan.py"].as_module()
+            report = gltf_scan.scan_file(asset.path, utils.TILEABLE_KEYWORDS)
+            if not report["ok"]:
+                raise ValueError(report["error"])
+            cache_dir = os.path.join(self.input_dir, utils.GLTF_CACHE_DIR)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            asset.file_hash = utils.gltf_file_hash(asset.path)
+            library_path = os.path.join(cache_dir, asset.file_hash + ".blend")
+            objects = utils.import_gltf_asset(asset.path, self.tile_collection, self.imported_collection, library_path, gltf_scan.import_tileable(report))
+            if not objects:
+                raise ValueError("no objects imported")
+            utils.deduplicate_meshes(objects)
+            asset.object_names = [obj.name for obj in objects]
+
+        elif stage == "segmentation":
+            smap.segmentation_map(objects=asset.objects())
+
+        elif stage == "generation":
+            settings = bpy.context.scene.dream_texture_settings
+            if self.texturing is None:
+                settings.started = True
+                settings.in_process = False
+                # The asset's journal is keyed by its content: a rerun of the same file resumes, another file never matches
+                if dream_textures.generate_textures_for_all_materials(asset.objects(), on_done=lambda: setattr(asset, "generated", True),
+                                                                      journal_scope=asset.file_hash):
+                    self.texturing = asset
+                    asset.generation_started = time.time()
+                return False # started, or another queue (a server request) is still running: try again next tick
+            if self.texturing is not asset:
+                return False
+            if not asset.generated:
+                # A queue whose timer died never calls on_done: fail the asset so the others get the queue
+                if not dream_textures.texture_queue_running():
+                    dream_textures.stop_texture_queue()
+                    raise RuntimeError("texture queue stopped before finishing")
+                if time.time() - asset.generation_started > GENERATION_TIMEOUT:
+                    dream_textures.stop_texture_queue()
+                    raise RuntimeError("texture generation timed out after {:.0f}s".format(GENERATION_TIMEOUT))
+                return False
+
+        elif stage == "normals":
+            tileable = [obj for obj in asset.objects() if obj.name in self.tile_collection.objects]
+            if tileable:
+                utils.colortonormals(tileable)
+
+        elif stage == "export":
+            objects = asset.objects()
+            utils.export(self.output_dir, objects, [name for obj in objects for name in smap.segmentation_image_names(obj)])
+
+        elif stage == "release":
+            self.release(asset)
+            self.texturing = None
+            self.move(asset, PROCESSED_FOLDER)
+            self.in_flight.remove(asset)
+            self.finished += 1
+            print("[WATCH] {} done in {:.1f}s ({} done, {} failed, {} in flight)".format(
+                asset.file, time.time() - asset.started, self.finished, self.failed, len(self.in_flight)))
+            return True
+
+        asset.stage += 1
+        return True
+
+    def release(self, asset):
+        # Remove the asset's objects and the data only they used, so memory stays flat over a long run
+        objects = asset.objects()
+        meshes = set(obj.data for obj in objects if obj.type == 'MESH')
+        materials = set(slot.material for obj in objects for slot in obj.material_slots if slot.material)
+        images = set(node.image for material in materials if material.node_tree
+                     for node in material.node_tree.nodes if node.type == 'TEX_IMAGE' and node.image)
+        images.update(bpy.data.images[name] for obj in objects for name in smap.segmentation_image_names(obj) if name in bpy.data.images)
+
+        bpy.data.batch_remove(objects)
+        for datablocks, collection in ((meshes, bpy.data.meshes), (materials, bpy.data.materials), (images, bpy.data.images)):
+            for datablock in datablocks:
+                if datablock.users == 0:
+                    collection.remove(datablock)
+
+    def move(self, asset, folder):
+        target_dir = os.path.join(self.input_dir, folder)
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir)
+        shutil.move(asset.path, os.path.join(target_dir, asset.file))
+
+    def fail(self, asset, error):
+        print("[WATCH] {} failed at {}: {}".format(asset.file, STAGES[asset.stage], error))
+        if asset.object_names:
+            try:
+                self.release(asset)
+            except Exception as e:
+                print("[WATCH] Could not release {}: {}".format(asset.file, e))
+        if self.texturing is asset:
+            self.texturing = None
+        try:
+            self.move(asset, FAILED_FOLDER)
+        except Exception as e:
+            # An exception here would escape tick() and unregister the watch timer
+            print("[WATCH] Could not move {} to {}: {}".format(asset.file, FAILED_FOLDER, e))
+        self.in_flight.remove(asset)
+        self.failed += 1
+
+    def tick(self):
+        if self.stopped:
+            return None
+        if time.time() - self.last_poll >= WATCH_INTERVAL:
+            self.poll()
+
+        progressed = False
+        for asset in list(self.in_flight):
+            try:
+                progressed = self.advance(asset) or progressed
+            except Exception as e:
+                self.fail(asset, e)
+                progressed = True
+
+        # Come back right away while stages are moving, otherwise wait for the next poll
+        return 0.1 if progressed else WATCH_INTERVAL
+
+def watch_folder(input_dir=None, output_dir=None, max_in_flight=None):
+    stop_watch()
+    watcher = WatchFolder(input_dir or INPUT_DIR, output_dir or OUTPUT_DIR, max_in_flight)
+    bpy.app.driver_namespace[NAMESPACE_KEY] = watcher
+    bpy.app.timers.register(watcher.tick)
+    print("[WATCH] Watching", watcher.input_dir)
+    return watcher
 
-if __name__ == "__main__": 
-    tile_collection, imported_collection= utils.import_gltf_files("C:/Users/Vertex Studio/Desktop/2023/250523/microverse-component-library-v0.0.2/archive_temp//") 
-    dream_textures.register_dream_texture_settings()
-    smap.segmentation_map()
-    run_process()
+def stop_watch():
+    watcher = bpy.app.driver_namespace.pop(NAMESPACE_KEY, None)
+    if watcher is not None:
+        watcher.stopped = True
 
+if __name__ == "__main__":
+    if WATCH_MODE:
+        dream_textures.register_dream_texture_settings()
+        watch_folder()
+    else:
+        tile_collection, imported_collection= utils.import_gltf_files(INPUT_DIR)
+        dream_textures.register_dream_texture_settings()
+        smap.segmentation_map()
+        run_process()
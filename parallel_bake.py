@@ -0,0 +1,116 @@
+import bpy
+import os
+import sys
+import json
+import shutil
+import subprocess
+import tempfile
+
+smap = bpy.data.texts["segmentation_map.py"].as_module()
+image_cache = bpy.data.texts["image_cache.py"].as_module()
+
+MANIFEST_FILE = "manifest.json"
+
+# Runs inside each "blender -b" worker on a saved copy of the scene
+WORKER_EXPR = 'import bpy; bpy.data.texts["parallel_bake.py"].as_module().run_worker()'
+
+def split_work(object_names, workers):
+    # Round-robin so every worker gets a similar share of the serial order
+    return [shard for shard in (object_names[k::workers] for k in range(workers)) if shard]
+
+def run_worker():
+    argv = sys.argv[sys.argv.index("--") + 1:]
+    output_dir, config, object_names = argv[0], json.loads(argv[1]), argv[2:]
+    smap.apply_segmentation_config(config)
+
+    manifest = {}
+    for name in object_names:
+        obj = bpy.data.objects.get(name)
+        if obj is None:
+            print("[PARALLEL BAKE] Object not found in worker:", name)
+            continue
+        # Workers never open the cache: concurrent writers would overwrite each other's index. The parent stores the results
+        smap.generate_segmentation_map(obj, use_cache=False)
+        bpy.ops.object.select_all(action='DESELECT')
+
+        files = []
+        for image_name in smap.segmentation_image_names(obj):
+            image = bpy.data.images.get(image_name)
+            if image is None:
+                continue
+            path = os.path.join(output_dir, image_name + ".png")
+            image_cache.save_image_copy(image, path)
+            files.append([image_name, path])
+        manifest[name] = files
+
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+
+def bake_in_workers(objects, workers, config=None):
+    # config: segmentation_map.segmentation_config() of the caller; this module's smap copy only has the defaults
+    config = config or smap.segmentation_config()
+    smap.apply_segmentation_config(config)
+
+    # Scene edits that bake would do on objects without materials must happen here, not in the workers' copies
+    for obj in objects:
+        smap.prepare_segmentation_object(obj)
+    bpy.ops.object.select_all(action='DESELECT')
+
+    # Cache hits load here; only the misses go to the workers, and their results are stored here under these keys
+    export_folder_path = smap.segmentation_export_folder()
+    cache = smap.get_segmentation_cache()
+    cache_keys = {}
+    object_names = []
+    for obj in objects:
+        bpy.context.view_layer.objects.active = obj
+        bpy.ops.object.mode_set(mode='OBJECT')
+        cache_key = smap.segmentation_cache_key(obj, smap.SEGMENTATION_MODE, smap.bake_resolution(obj)) if cache is not None else None
+        if smap.load_segmentation_map(obj, cache_key, export_folder_path):
+            continue
+        cache_keys[obj.name] = cache_key
+        object_names.append(obj.name)
+    if not object_names:
+        return
+
+    # The copy sits next to the .blend so the workers resolve segmentation_maps/ and the cache to the same folders
+    folder_path = os.path.dirname(bpy.data.filepath)
+    scene_copy = os.path.join(folder_path, ".segmentation_workers.blend")
+    bpy.ops.wm.save_as_mainfile(filepath=scene_copy, copy=True)
+
+    shards = split_work(object_names, workers)
+    output_dirs = [tempfile.mkdtemp(prefix="segmentation_worker_") for _ in shards]
+    try:
+        processes = []
+        for shard, output_dir in zip(shards, output_dirs):
+            command = [bpy.app.binary_path, "-b", scene_copy, "--python-expr", WORKER_EXPR, "--", output_dir, json.dumps(config)] + shard
+            processes.append(subprocess.Popen(command))
+        print("[PARALLEL BAKE] {} objects across {} workers".format(len(object_names), len(processes)))
+
+        manifest = {}
+        for process, output_dir in zip(processes, output_dirs):
+            if process.wait() != 0:
+                print("[PARALLEL BAKE] Worker exited with code", process.returncode)
+            manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+            if os.path.exists(manifest_path):
+                with open(manifest_path) as f:
+                    manifest.update(json.load(f))
+
+        # Merge in the serial order so the resulting datablocks match a serial run
+        for name in object_names:
+            if name not in manifest:
+                print("[PARALLEL BAKE] No result for {}, baking here".format(name))
+                smap.generate_segmentation_map(bpy.data.objects[name], use_cache=False)
+                bpy.ops.object.select_all(action='DESELECT')
+            else:
+                for image_name, path in manifest[name]:
+                    image = bpy.data.images.load(path)
+                    image.name = image_name
+                    image.pack()
+                    image.filepath_raw = image.name
+                    bpy.data.objects[name]["segmentation_resolution"] = image.size[0]
+            smap.store_segmentation_map(bpy.data.objects[name], cache_keys[name])
+    finally:
+        for output_dir in output_dirs:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        if os.path.exists(scene_copy):
+            os.remove(scene_copy)
@@ -0,0 +1,189 @@
+import bpy
+import hashlib
+import numpy as np
+
+UV_FINGERPRINT_DECIMALS = 4 # decimales a los que se cuantizan las UV antes de calcular su huella (str(Vector) también redondeaba a 4), None para usar los floats exactos.
+NAMESPACE_KEY = "scene_index" # clave en bpy.app.driver_namespace: el índice sobrevive aunque cada as_module() cree un módulo nuevo.
+
+def uv_fingerprint(mesh, decimals=None): #! huella compacta del mapa UV activo: hash del buffer de floats obtenido con foreach_get (opcionalmente cuantizado). Devuelve None si no hay UV.
+    if mesh.uv_layers.active is None:
+        return None
+    if decimals is None:
+        decimals = UV_FINGERPRINT_DECIMALS
+
+    uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+    mesh.uv_layers.active.data.foreach_get("uv", uvs)
+    if decimals is not None:
+        uvs = np.round(uvs, decimals) + np.float32(0.0) # el "+ 0.0" convierte -0.0 en 0.0 para que no cambie el hash.
+
+    digest = hashlib.blake2b(uvs.tobytes(), digest_size=16)
+    digest.update(str(len(mesh.loops)).encode())
+    return digest.hexdigest()
+
+class SceneIndex:
+    """Material, UV fingerprint and collection lookups for the objects in bpy.data, updated incrementally"""
+
+    def __init__(self):
+        self.objects = {}           # object name -> {"name", "id", "type"}
+        self.object_materials = {}  # object name -> tuple of material names
+        self.object_uv = {}         # object name -> UV fingerprint (or None)
+        self.object_mesh = {}       # object name -> mesh name
+        self.pointers = {}          # object pointer -> object name, to notice renames
+        self.material_objects = {}  # material name -> {object name: None} (ordered set)
+        self.material_pointers = {} # material pointer -> material name, to notice renames
+        self.uv_objects = {}        # UV fingerprint -> {object name: None}
+        self.mesh_objects = {}      # mesh name -> {object name: None}
+        self.collections = {}       # collection name -> list of object names, filled on demand
+        self.materials = None       # list of {"name", "id"} for bpy.data.materials, filled on demand
+        self.dirty = set()
+        self.built = False
+
+    def build(self):
+        self.__init__()
+        for obj in bpy.data.objects:
+            self.add_object(obj)
+        self.built = True
+
+    def add_object(self, obj):
+        name = obj.name
+        self.objects[name] = {"name": name, "id": obj.as_pointer(), "type": obj.type}
+        self.pointers[obj.as_pointer()] = name
+
+        materials = tuple(slot.material.name for slot in obj.material_slots if slot.material)
+        self.object_materials[name] = materials
+        for slot in obj.material_slots:
+            if slot.material:
+                self.material_pointers[slot.material.as_pointer()] = slot.material.name
+        for material in materials:
+            self.material_objects.setdefault(material, {})[name] = None
+
+        if obj.type == 'MESH':
+            fingerprint = uv_fingerprint(obj.data)
+            self.object_uv[name] = fingerprint
+            if fingerprint is not None:
+                self.uv_objects.setdefault(fingerprint, {})[name] = None
+            self.object_mesh[name] = obj.data.name
+            self.mesh_objects.setdefault(obj.data.name, {})[name] = None
+
+    def remove_object(self, name):
+        info = self.objects.pop(name, None)
+        if info is None:
+            return
+        self.pointers.pop(info["id"], None)
+        for material in self.object_materials.pop(name, ()):
+            self.discard(self.material_objects, material, name)
+        fingerprint = self.object_uv.pop(name, None)
+        if fingerprint is not None:
+            self.discard(self.uv_objects, fingerprint, name)
+        mesh = self.object_mesh.pop(name, None)
+        if mesh is not None:
+            self.discard(self.mesh_objects, mesh, name)
+
+    def discard(self, mapping, key, name):
+        members = mapping.get(key)
+        if members is not None:
+            members.pop(name, None)
+            if not members:
+                del mapping[key]
+
+    def renamed(self, obj):
+        old_name = self.pointers.get(obj.as_pointer())
+        return old_name is not None and old_name != obj.name
+
+    def mark(self, obj):
+        # A renamed object keeps its pointer: drop the entry under the old name
+        old_name = self.pointers.get(obj.as_pointer())
+        if old_name is not None and old_name != obj.name:
+            self.dirty.add(old_name)
+        self.dirty.add(obj.name)
+
+    def mark_material(self, material):
+        # A renamed material: re-add the objects listed under its old name
+        old_name = self.material_pointers.get(material.as_pointer())
+        if old_name is not None and old_name != material.name:
+            self.dirty.update(self.material_objects.get(old_name, ()))
+            self.material_pointers[material.as_pointer()] = material.name
+
+    def sync(self):
+        if not self.built:
+            self.build()
+            return self
+        self.refresh_dirty()
+        # Deleted objects send no update: only a count mismatch tells, then reconcile the names
+        if len(bpy.data.objects) != len(self.objects):
+            self.dirty.update(name for name in self.objects if name not in bpy.data.objects)
+            self.dirty.update(obj.name for obj in bpy.data.objects if obj.name not in self.objects)
+            self.refresh_dirty()
+        return self
+
+    def refresh_dirty(self):
+        for name in self.dirty:
+            self.remove_object(name)
+            obj = bpy.data.objects.get(name)
+            if obj is not None:
+                self.add_object(obj)
+        self.dirty.clear()
+
+    def collection_objects(self, collection_name):
+        names = self.collections.get(collection_name)
+        if names is None:
+            collection = bpy.data.collections.get(collection_name)
+            if collection is None:
+                return None
+            names = [obj.name for obj in collection.objects]
+            self.collections[collection_name] = names
+        return names
+
+    def material_list(self):
+        if self.materials is None or len(self.materials) != len(bpy.data.materials):
+            self.materials = [{"name": mat.name, "id": mat.as_pointer()} for mat in bpy.data.materials]
+        return self.materials
+
+    def has_material(self, name, material):
+        return name in self.material_objects.get(material, {})
+
+@bpy.app.handlers.persistent
+def scene_index_depsgraph_update(scene, depsgraph):
+    index = bpy.app.driver_namespace.get(NAMESPACE_KEY)
+    if index is None or not index.built:
+        return
+    for update in depsgraph.updates:
+        id_data = update.id.original
+        if isinstance(id_data, bpy.types.Object):
+            # Moving an object sends an update too: only geometry, shading (material slots) or a rename change the index
+            if update.is_updated_geometry or update.is_updated_shading or index.renamed(id_data):
+                index.mark(id_data)
+                index.collections.clear()
+        elif isinstance(id_data, bpy.types.Mesh):
+            if update.is_updated_geometry:
+                index.dirty.update(index.mesh_objects.get(id_data.name, ()))
+        elif isinstance(id_data, bpy.types.Material):
+            index.mark_material(id_data)
+            index.materials = None
+        elif isinstance(id_data, bpy.types.Collection):
+            index.collections.pop(id_data.name, None)
+        elif isinstance(id_data, bpy.types.Scene):
+            # Linking or unlinking objects in the scene collection
+            index.collections.clear()
+
+# A loaded file has other objects: rebuild on the next sync instead of reconciling names with the old file
+@bpy.app.handlers.persistent
+def scene_index_load_post(*args):
+    index = bpy.app.driver_namespace.get(NAMESPACE_KEY)
+    if index is not None:
+        index.built = False
+
+def register_scene_index():
+    # Each as_module() creates a new function object: replace any handler left by a previous load
+    for handlers, function in ((bpy.app.handlers.depsgraph_update_post, scene_index_depsgraph_update), (bpy.app.handlers.load_post, scene_index_load_post)):
+        for handler in [h for h in handlers if getattr(h, "__name__", "") == function.__name__]:
+            handlers.remove(handler)
+        handlers.append(function)
+
+def get_scene_index():
+    index = bpy.app.driver_namespace.get(NAMESPACE_KEY)
+    if index is None:
+        index = SceneIndex()
+        bpy.app.driver_namespace[NAMESPACE_KEY] = index
+        register_scene_index()
+    return index.sync()
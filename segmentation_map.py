@@ -3,8 +3,28 @@ import random  # modulo de Python que proporciona funciones para generar número
 #? BMesh = es una representación interna de una malla en Blender que permite acceder y manipular de forma eficiente de topología y geometía de una malla.
 import bmesh #módulo de Blender que proporciona funciones y clases para realizar operaciones avanzadas en mallas (meshes) utilizando la estructura de datos BMesh.
 import os # libreria que permite acceder a funciones con el sistema operativo.
+import hashlib # librería para calcular hashes (huellas) de datos binarios.
+import numpy as np # librería para operar con arreglos numéricos de forma vectorizada.
 
 utils = bpy.data.texts["utils.py"].as_module() # importamos el archivo "utils.py" para poder importar y trabajar con sus funciones.
+image_cache = bpy.data.texts["image_cache.py"].as_module() # caché en disco de imágenes direccionada por contenido.
+scene_index = bpy.data.texts["scene_index.py"].as_module() # índice persistente de materiales, UV y objetos de la escena.
+
+SEGMENTATION_MODE = "BAKE" # "BAKE" hornea con Cycles, "RASTER" rasteriza los triángulos UV directamente con NumPy (sin motor de render).
+ISLAND_COLOR_MODE = "MATERIAL" # "MATERIAL" crea un material por isla, "ATTRIBUTE" escribe el color de cada isla en un atributo de cara y hornea con un único material temporal.
+ISLAND_COLOR_ATTRIBUTE = "SegmentationIsland" # nombre del atributo de color temporal usado en el modo "ATTRIBUTE".
+RASTER_CHUNK_PIXELS = 1 << 22 # cantidad máxima de píxeles candidatos que se evalúan por bloque al rasterizar.
+ATLAS_BAKE = False # True: los objetos que comparten un único material se hornean juntos, en una sola pasada, en un atlas compartido.
+ATLAS_UV_LAYER = "AtlasUV" # mapa UV temporal con las UV de cada objeto trasladadas a su celda del atlas.
+ATLAS_MAX_RESOLUTION = 4096 # lado máximo (en píxeles) de la imagen del atlas.
+TEXEL_DENSITY = 256 # resolución adaptativa: píxeles por metro de superficie que se buscan en el mapa de segmentación.
+MIN_BAKE_RESOLUTION = 64 # lado mínimo (en píxeles) de un mapa de segmentación.
+MAX_BAKE_RESOLUTION = 2048 # lado máximo (en píxeles) de un mapa de segmentación.
+SEGMENTATION_WORKERS = 1 # cantidad de procesos "blender -b" que hornean en paralelo, 1 para hornear en serie en esta instancia.
+SEGMENTATION_CACHE_BYTES = 2 * 1024 ** 3 # tamaño máximo de la caché de mapas de segmentación en disco (LRU), 0 para desactivarla.
+# ajustes que parallel_bake pasa a sus procesos: cada as_module() es una copia nueva del módulo con los valores por defecto.
+WORKER_CONFIG = ("SEGMENTATION_MODE", "ISLAND_COLOR_MODE", "RASTER_CHUNK_PIXELS", "TEXEL_DENSITY", "MIN_BAKE_RESOLUTION", "MAX_BAKE_RESOLUTION")
+CACHE_NAMESPACE_KEY = "segmentation_cache" # clave en bpy.app.driver_namespace: todas las copias del módulo (as_module) usan la misma caché y sus estadísticas.
 
 def get_linked_faces(f): #! función que toma una cara "f" y devuelve una lista de caras conectadas a través de bordes compartidos. Utiliza un enfoque de búsqueda en profundidad para recorrer las caras conectadas.
 
@@ -66,9 +86,50 @@ def get_object_islands_bmesh(obj): # función que toma un objeto "obj" y devuelv
 
     return (bm, islands)
 
+def get_island_labels(mesh): #! versión vectorizada de "get_object_islands_bmesh": devuelve un arreglo con el índice de isla de cada cara, usando NumPy en lugar de recorrer el BMesh en Python.
+    num_faces = len(mesh.polygons)
+    num_loops = len(mesh.loops)
+
+    # foreach_get only takes the fast buffer path when the dtype matches the RNA property (int32)
+    loop_edges = np.empty(num_loops, dtype=np.int32)
+    mesh.loops.foreach_get("edge_index", loop_edges)
+    loop_totals = np.empty(num_faces, dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    loop_faces = np.repeat(np.arange(num_faces, dtype=np.int64), loop_totals)
+
+    # Same rule as get_linked_faces: only edges with exactly two linked faces connect an island
+    edge_counts = np.bincount(loop_edges, minlength=len(mesh.edges))
+    manifold = edge_counts[loop_edges] == 2
+    order = np.argsort(loop_edges[manifold], kind="stable")
+    paired_faces = loop_faces[manifold][order].reshape(-1, 2)
+    a, b = paired_faces[:, 0], paired_faces[:, 1]
+
+    # Connected components by min-label propagation with pointer jumping (union-find without a Python loop)
+    labels = np.arange(num_faces, dtype=np.int64)
+    while True:
+        la, lb = labels[a], labels[b]
+        low = np.minimum(la, lb)
+        previous = labels.copy()
+        np.minimum.at(labels, la, low)
+        np.minimum.at(labels, lb, low)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, previous):
+            break
+
+    # Renumber the islands in order of their first face, like the BMesh walk does
+    _, first_faces, labels = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(first_faces)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[labels.reshape(-1)]
+
 #? hornear texturas = En el contexto del horneado de texturas, se aplican diferentes propiedades y configuraciones del material (como color, brillo, rugosidad, etc.) al objeto y luego se realiza el proceso de bake para generar las texturas resultantes. Durante el horneado, se calculan y asignan los valores de color y otros atributos a los píxeles de la textura, creando así una representación final de la apariencia del objeto.
 
-def multiple_bake(obj, folder_path): #! función que realiza el proceso de horneado para múltiples materiales de un objeto. Itera sobre los materiales del objeto y crea un nuevo material para cada uno de ellos. Luego establece una nueva textura de imagen para cada material y realiza la cocción del objeto para cada material.
+def multiple_bake(obj, folder_path, resolution=512): #! función que realiza el proceso de horneado para múltiples materiales de un objeto. Itera sobre los materiales del objeto y crea un nuevo material para cada uno de ellos. Luego establece una nueva textura de imagen para cada material y realiza la cocción del objeto para cada material.
 
     for i, mat in enumerate(obj.data.materials): # itera sobre los materiales asociados al obeto "obj"
         #todo Creamos un nuevo material con un color random y con un nombre basado en el nombre de un material existente.
@@ -96,7 +157,7 @@ def multiple_bake(obj, folder_path): #! función que realiza el proceso de horne
         tree = material.node_tree
 
         texture_node = tree.nodes.new('ShaderNodeTexImage')
-        tex_image = bpy.data.images.new(name= obj.name + "_" + str(i) + "_T_SegmentationMap", width=512, height=512)
+        tex_image = bpy.data.images.new(name= obj.name + "_" + str(i) + "_T_SegmentationMap", width=resolution, height=resolution)
 
         # Set the texture node to the diffuse channel
 #        tex_image = bpy.data.images.new("{}_diffuse.png".format(material.name), width=512, height=512)
@@ -118,16 +179,15 @@ def multiple_bake(obj, folder_path): #! función que realiza el proceso de horne
         print("Baking Done")
 
 
-def single_bake(obj, folder_path):
-
-    bpy.context.view_layer.objects.active = obj
-    bm, islands = get_object_islands_bmesh(obj)
-
-    tex_image = bpy.data.images.new(name= obj.name + "_1" + "_T_SegmentationMap", width=512, height=512)
+def random_island_colors(num_islands): #! genera un color RGBA aleatorio (opaco) para cada isla.
+    return np.array([(random.random(), random.random(), random.random(), 1.0) for _ in range(num_islands)], dtype=np.float32).reshape(-1, 4)
 
+def assign_island_materials(obj, labels, tex_image): #! crea un material "_new" por isla, todos con el nodo de la imagen "tex_image", y asigna cada isla a su material.
+    num_islands = int(labels.max()) + 1 if len(labels) else 0
+    first_index = len(obj.data.materials)
 
     # create new materials and image textures for each island and assign them to the mesh
-    for i, island in enumerate(islands):
+    for i in range(num_islands):
         mat = bpy.data.materials.new(name="Island_{}_{}".format(obj.name, i)+ "_new")
         mat.use_nodes = True
         mat.node_tree.nodes["Principled BSDF"].inputs[0].default_value = (random.random(), random.random(), random.random(), random.random())
@@ -137,19 +197,51 @@ def single_bake(obj, folder_path):
         tex_node = nodes.new('ShaderNodeTexImage')
         tex_node.image = tex_image
 
-        # assign the material to the island
         obj.data.materials.append(mat)
-        mat_index = len(obj.data.materials) - 1
-        for face in island:
-            face.material_index = mat_index
 
+    # assign every island to its material in one call
+    obj.data.polygons.foreach_set("material_index", (labels + first_index).astype(np.int32))
+    obj.data.update()
+
+def assign_island_color_attribute(obj, labels, tex_image): #! escribe el color de cada isla en un atributo de cara y asigna toda la malla a un único material "_new" que lo lee. Devuelve los índices de material originales para poder restaurarlos.
+    mesh = obj.data
+    num_islands = int(labels.max()) + 1 if len(labels) else 0
+
+    material_indices = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("material_index", material_indices)
+
+    attribute = mesh.attributes.new(name=ISLAND_COLOR_ATTRIBUTE, type='FLOAT_COLOR', domain='FACE')
+    attribute.data.foreach_set("color", random_island_colors(num_islands)[labels].ravel())
+
+    # one temporary material reads the attribute, whatever the number of islands
+    mat = bpy.data.materials.new(name="Islands_{}".format(obj.name) + "_new")
+    mat.use_nodes = True
+    nodes = mat.node_tree.nodes
+    attribute_node = nodes.new('ShaderNodeAttribute')
+    attribute_node.attribute_name = ISLAND_COLOR_ATTRIBUTE
+    mat.node_tree.links.new(attribute_node.outputs["Color"], nodes["Principled BSDF"].inputs[0])
+    tex_node = nodes.new('ShaderNodeTexImage')
+    tex_node.image = tex_image
+    nodes.active = tex_node
 
-    # update the object's mesh from the bmesh
-    if obj.mode == 'OBJECT':
-        bm.to_mesh(obj.data)
-        bm.free()
+    mesh.materials.append(mat)
+    mesh.polygons.foreach_set("material_index", np.full(len(mesh.polygons), len(mesh.materials) - 1, dtype=np.int32))
+    mesh.update()
+    return material_indices
+
+def single_bake(obj, folder_path, color_mode=None, resolution=512):
+    color_mode = color_mode or ISLAND_COLOR_MODE
+
+    bpy.context.view_layer.objects.active = obj
+    bpy.ops.object.mode_set(mode='OBJECT')
+    labels = get_island_labels(obj.data)
+
+    tex_image = bpy.data.images.new(name= obj.name + "_1" + "_T_SegmentationMap", width=resolution, height=resolution)
+
+    if color_mode == "ATTRIBUTE":
+        material_indices = assign_island_color_attribute(obj, labels, tex_image)
     else:
-        bmesh.update_edit_mesh(obj.data)
+        assign_island_materials(obj, labels, tex_image)
 
     # Deselect all objects
     bpy.ops.object.select_all(action='DESELECT')
@@ -175,14 +267,236 @@ def single_bake(obj, folder_path):
     # Deselect the object
     obj.select_set(False)
 
+    if color_mode == "ATTRIBUTE":
+        # restore the original assignment so restore_materials only has one slot to drop
+        obj.data.polygons.foreach_set("material_index", material_indices)
+        obj.data.attributes.remove(obj.data.attributes[ISLAND_COLOR_ATTRIBUTE])
+        obj.data.update()
+
+def get_uv_triangles(mesh): #! devuelve las coordenadas UV de cada triángulo de la malla (T, 3, 2) y el índice de la cara a la que pertenece cada triángulo.
+    mesh.calc_loop_triangles()
+    num_triangles = len(mesh.loop_triangles)
+
+    tri_loops = np.empty(num_triangles * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get("loops", tri_loops)
+    tri_faces = np.empty(num_triangles, dtype=np.int32)
+    mesh.loop_triangles.foreach_get("polygon_index", tri_faces)
+
+    uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+    mesh.uv_layers.active.data.foreach_get("uv", uvs)
+
+    return uvs.reshape(-1, 2)[tri_loops].reshape(-1, 3, 2), tri_faces
+
+def rasterize_uv_triangles(uv_tris, tri_colors, width, height, pixels=None): #! pinta cada triángulo UV con su color en un buffer RGBA (height, width, 4), probando los centros de píxel en bloque con NumPy.
+    if pixels is None:
+        pixels = np.zeros((height, width, 4), dtype=np.float32)
+        pixels[..., 3] = 1.0 # igual que una imagen nueva de Blender: negro opaco.
+
+    # Pixel centers land on integer coordinates; Blender stores rows bottom to top, like UV v
+    pts = uv_tris.astype(np.float64) * (width, height) - 0.5
+    x0, y0 = pts[:, 0, 0], pts[:, 0, 1]
+    x1, y1 = pts[:, 1, 0], pts[:, 1, 1]
+    x2, y2 = pts[:, 2, 0], pts[:, 2, 1]
+    area = (x1 - x0) * (y2 - y0) - (y1 - y0) * (x2 - x0)
+
+    xmin = np.clip(np.ceil(pts[..., 0].min(axis=1)), 0, width).astype(np.int64)
+    xmax = np.clip(np.floor(pts[..., 0].max(axis=1)), -1, width - 1).astype(np.int64)
+    ymin = np.clip(np.ceil(pts[..., 1].min(axis=1)), 0, height).astype(np.int64)
+    ymax = np.clip(np.floor(pts[..., 1].max(axis=1)), -1, height - 1).astype(np.int64)
+    box_w = np.maximum(xmax - xmin + 1, 0)
+    box_h = np.maximum(ymax - ymin + 1, 0)
+    counts = box_w * box_h
+    counts[area == 0] = 0
+
+    tris = np.flatnonzero(counts)
+    ends = np.cumsum(counts[tris])
+    start = 0
+    while start < len(tris):
+        # Take as many whole triangles as fit in one chunk of candidate pixels
+        done = ends[start - 1] if start else 0
+        stop = max(int(np.searchsorted(ends, done + RASTER_CHUNK_PIXELS, side="right")), start + 1)
+        chunk = tris[start:stop]
+        start = stop
+
+        chunk_counts = counts[chunk]
+        idx = np.repeat(chunk, chunk_counts)
+        offsets = np.arange(len(idx)) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+        px = xmin[idx] + offsets % box_w[idx]
+        py = ymin[idx] + offsets // box_w[idx]
+
+        # Edge functions, flipped by the winding so both orientations count as inside
+        sign = np.sign(area[idx])
+        e0 = ((x2[idx] - x1[idx]) * (py - y1[idx]) - (y2[idx] - y1[idx]) * (px - x1[idx])) * sign
+        e1 = ((x0[idx] - x2[idx]) * (py - y2[idx]) - (y0[idx] - y2[idx]) * (px - x2[idx])) * sign
+        e2 = ((x1[idx] - x0[idx]) * (py - y0[idx]) - (y1[idx] - y0[idx]) * (px - x0[idx])) * sign
+        inside = (e0 >= 0) & (e1 >= 0) & (e2 >= 0)
+
+        pixels[py[inside], px[inside]] = tri_colors[idx[inside]]
+
+    return pixels
+
+def save_segmentation_image(name, pixels, filepath): #! crea la imagen "name" en Blender a partir del buffer de píxeles, la empaqueta y la guarda como PNG igual que el horneado.
+    height, width = pixels.shape[:2]
+    tex_image = bpy.data.images.new(name=name, width=width, height=height)
+    tex_image.colorspace_settings.name = 'sRGB'
+    tex_image.filepath_raw = tex_image.name
+    tex_image.pixels.foreach_set(pixels.ravel())
+    tex_image.pack()
+    tex_image.save_render(filepath)
+    return tex_image
 
-def generate_segmentation_map(obj):
-    blend_file_path = bpy.data.filepath
-    folder_path = os.path.dirname(blend_file_path)
-
-    export_folder_path = os.path.join(folder_path, "segmentation_maps")
+def raster_bake(obj, folder_path, resolution=512): #! alternativa a "single_bake"/"multiple_bake" sin Cycles: rasteriza los triángulos UV coloreados por material (varios materiales) o por isla (un material).
+    bpy.context.view_layer.objects.active = obj
+    bpy.ops.object.mode_set(mode='OBJECT')
+    mesh = obj.data
+    width = height = resolution
+
+    uv_tris, tri_faces = get_uv_triangles(mesh)
+
+    if len(obj.material_slots) > 1:
+        face_materials = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get("material_index", face_materials)
+        tri_materials = face_materials[tri_faces]
+
+        for i, material_slot in enumerate(obj.material_slots):
+            color = np.array((random.random(), random.random(), random.random(), 1.0), dtype=np.float32)
+            mask = tri_materials == i
+            pixels = rasterize_uv_triangles(uv_tris[mask], np.broadcast_to(color, (int(mask.sum()), 4)), width, height)
+            material_name = material_slot.material.name if material_slot.material else "Material"
+            save_segmentation_image(obj.name + "_" + str(i + 1) + "_T_SegmentationMap", pixels, folder_path + material_name + "_new_BakedTexture.png")
+    else:
+        labels = get_island_labels(mesh)
+        num_islands = int(labels.max()) + 1 if len(labels) else 0
+        island_colors = random_island_colors(num_islands)
+        pixels = rasterize_uv_triangles(uv_tris, island_colors[labels[tri_faces]], width, height)
+        save_segmentation_image(obj.name + "_1" + "_T_SegmentationMap", pixels, folder_path + obj.name + "_BakedTexture.png")
+
+    print("raster done")
+
+
+def bake_resolution(obj): #! elige el lado del mapa de segmentación según la superficie del objeto y lo que ocupan sus UV, para acercarse a "TEXEL_DENSITY" (potencia de dos entre los límites). Lo guarda en el objeto para Dream Textures.
+    mesh = obj.data
+    resolution = 512
+
+    if mesh.uv_layers.active is not None and len(mesh.polygons) > 0:
+        areas = np.empty(len(mesh.polygons), dtype=np.float32)
+        mesh.polygons.foreach_get("area", areas)
+        # polygon areas are in local space: scale them by the object's (average) area scale
+        world_scale = abs(obj.matrix_world.to_3x3().determinant()) ** (2.0 / 3.0)
+        surface = float(areas.sum()) * world_scale
+
+        uv_tris, _ = get_uv_triangles(mesh)
+        edge_a = uv_tris[:, 1] - uv_tris[:, 0]
+        edge_b = uv_tris[:, 2] - uv_tris[:, 0]
+        uv_coverage = float(np.abs(edge_a[:, 0] * edge_b[:, 1] - edge_a[:, 1] * edge_b[:, 0]).sum()) * 0.5
+
+        if surface > 0 and uv_coverage > 0:
+            side = TEXEL_DENSITY * np.sqrt(surface / uv_coverage)
+            resolution = 2 ** int(round(np.log2(side)))
+
+    resolution = int(min(max(resolution, MIN_BAKE_RESOLUTION), MAX_BAKE_RESOLUTION))
+    obj["segmentation_resolution"] = resolution
+    return resolution
+
+def segmentation_image_names(obj): #! nombres de las imágenes de segmentación que genera el horneado para el objeto (una por material si tiene varios, si no una sola).
+    count = len(obj.material_slots) if len(obj.material_slots) > 1 else 1
+    return [obj.name + "_" + str(i) + "_T_SegmentationMap" for i in range(1, count + 1)]
+
+def get_segmentation_cache(): #! devuelve la caché de mapas de segmentación, creándola junto al archivo .blend la primera vez.
+    if not SEGMENTATION_CACHE_BYTES:
+        return None
+    cache_path = os.path.join(os.path.dirname(bpy.data.filepath), "segmentation_cache")
+    cache = bpy.app.driver_namespace.get(CACHE_NAMESPACE_KEY)
+    if cache is None or cache.directory != cache_path:
+        cache = image_cache.ImageCache(cache_path, SEGMENTATION_CACHE_BYTES)
+        bpy.app.driver_namespace[CACHE_NAMESPACE_KEY] = cache
+    return cache
+
+def segmentation_export_paths(obj, folder_path): #! rutas de los PNG que el horneado exporta para el objeto: una por material "_new" si tiene varios, si no una con el nombre del objeto.
+    if len(obj.material_slots) > 1:
+        return [folder_path + (slot.material.name if slot.material else "Material") + "_new_BakedTexture.png" for slot in obj.material_slots]
+    return [folder_path + obj.name + "_BakedTexture.png"]
+
+def segmentation_config(): #! valores actuales de los ajustes de "WORKER_CONFIG" en esta copia del módulo.
+    return {name: globals()[name] for name in WORKER_CONFIG}
+
+def apply_segmentation_config(config): #! aplica a esta copia del módulo los ajustes devueltos por "segmentation_config".
+    for name, value in config.items():
+        if name in WORKER_CONFIG:
+            globals()[name] = value
+
+def segmentation_export_folder(): #! carpeta "segmentation_maps" junto al archivo .blend, creándola si no existe.
+    export_folder_path = os.path.join(os.path.dirname(bpy.data.filepath), "segmentation_maps")
     if not os.path.exists(export_folder_path):
         os.makedirs(export_folder_path)
+    return export_folder_path
+
+def load_segmentation_map(obj, cache_key, folder_path): #! carga de la caché las imágenes de segmentación del objeto y exporta sus PNG igual que el horneado. Devuelve False si no están.
+    cache = get_segmentation_cache()
+    if cache is None or cache_key is None:
+        return False
+    images = cache.load(cache_key, segmentation_image_names(obj))
+    if images is None:
+        return False
+    for image, path in zip(images, segmentation_export_paths(obj, folder_path)):
+        image.save_render(path)
+    print("Segmentation map loaded from cache:", obj.name)
+    return True
+
+def update_face_layout(digest, mesh): #! agrega al hash la topología de caras y el índice de material de cada cara de la malla.
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    loop_verts = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_verts)
+    material_indices = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("material_index", material_indices)
+    digest.update(loop_totals.tobytes())
+    digest.update(loop_verts.tobytes())
+    digest.update(material_indices.tobytes())
+
+def face_layout_hash(mesh): #! hash de la topología de caras y de la asignación de materiales: dos mallas con las mismas UV solo comparten mapa si también coincide esto.
+    digest = hashlib.blake2b(digest_size=16)
+    update_face_layout(digest, mesh)
+    return digest.hexdigest()
+
+def segmentation_cache_key(obj, mode, resolution): #! hash de la topología de caras, el mapa UV activo, la asignación de materiales y los ajustes de horneado del objeto (debe estar en modo objeto).
+    mesh = obj.data
+    digest = hashlib.blake2b(digest_size=20)
+    update_face_layout(digest, mesh)
+
+    if mesh.uv_layers.active is not None:
+        uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+        mesh.uv_layers.active.data.foreach_get("uv", uvs)
+        digest.update(uvs.tobytes())
+
+    settings = (mode, ISLAND_COLOR_MODE, len(obj.material_slots), bpy.context.scene.render.bake.margin, resolution)
+    digest.update(repr(settings).encode())
+    return digest.hexdigest()
+
+def store_segmentation_map(obj, cache_key): #! guarda en la caché las imágenes de segmentación recién generadas del objeto.
+    cache = get_segmentation_cache()
+    if cache is None or cache_key is None:
+        return
+    images = [bpy.data.images.get(name) for name in segmentation_image_names(obj)]
+    if all(image is not None for image in images):
+        cache.store(cache_key, images)
+
+def prepare_segmentation_object(obj): #! a un objeto sin materiales le crea uno, fusiona sus vértices y le genera el mapa UV, igual que antes de hornear.
+    if len(obj.material_slots) > 0:
+        return
+    new_material_name = "Material" + obj.name
+    new_material = bpy.data.materials.new(name=new_material_name)
+    new_material.use_nodes = True
+    obj.data.materials.append(new_material)
+    utils.merge(obj)
+    bpy.context.view_layer.objects.active = obj
+    utils.setup_uvmap(obj)
+
+def generate_segmentation_map(obj, mode=None, use_cache=True):
+    # use_cache=False: neither read nor write the cache (parallel_bake workers; the parent process does both)
+    mode = mode or SEGMENTATION_MODE
+    random.seed(obj.name) # colores aleatorios reproducibles: el mismo objeto da el mismo mapa en serie o en un proceso paralelo.
+    export_folder_path = segmentation_export_folder()
 
     mat = obj.active_material
     #    bpy.ops.object.select_all(action='DESELECT')
@@ -204,14 +518,20 @@ def generate_segmentation_map(obj):
 
     if num_materials == 0:
         bpy.ops.object.mode_set(mode='OBJECT')
-        new_material_name = "Material" + obj.name
-        new_material = bpy.data.materials.new(name=new_material_name)
-        new_material.use_nodes = True
-        obj.data.materials.append(new_material)
-        utils.merge(obj)
-        bpy.context.view_layer.objects.active = obj
-        utils.setup_uvmap(obj)
+        prepare_segmentation_object(obj)
 
+    # Reuse a previous result when topology, UVs, materials and settings are unchanged
+    bpy.ops.object.mode_set(mode='OBJECT')
+    resolution = bake_resolution(obj)
+    cache_key = segmentation_cache_key(obj, mode, resolution) if use_cache and get_segmentation_cache() is not None else None
+    if load_segmentation_map(obj, cache_key, export_folder_path):
+        return
+
+    if mode == "RASTER":
+        # No temporary materials or metallic changes are needed without Cycles
+        raster_bake(obj, export_folder_path, resolution)
+        store_segmentation_map(obj, cache_key)
+        return
 
     # Unlink image textures from Metallic channel
     linked_images = utils.unlink_image_from_metallic(obj)
@@ -219,14 +539,162 @@ def generate_segmentation_map(obj):
     previous_value, _ = utils.set_metallic_value(0.0)
 
     if num_materials > 1:
-        multiple_bake(obj, export_folder_path)
+        multiple_bake(obj, export_folder_path, resolution=resolution)
     else:
-        single_bake(obj, export_folder_path)
+        single_bake(obj, export_folder_path, resolution=resolution)
 
     utils.restore_materials()
     utils.revert_metallic_value(previous_value)
     # Link previously unlinked image textures back to Metallic channel
     utils.link_image_to_metallic(obj, linked_images)
+    store_segmentation_map(obj, cache_key)
+
+def share_segmentation_maps(source, target): #! reutiliza los mapas de segmentación ya horneados de "source" para "target" (mismas UV), copiando las imágenes con el nombre que espera el resto del pipeline.
+    for source_name, target_name in zip(segmentation_image_names(source), segmentation_image_names(target)):
+        if bpy.data.images.get(source_name) is None:
+            continue
+        image = bpy.data.images[source_name].copy()
+        image.name = target_name
+        image.filepath_raw = image.name
+    if "segmentation_resolution" in source:
+        target["segmentation_resolution"] = source["segmentation_resolution"]
+    print("Reusing segmentation map of {} for {}".format(source.name, target.name))
+
+def atlas_layout(meshes): #! reparte las mallas en una cuadrícula del atlas: devuelve el número de columnas y, por malla, la escala y el desplazamiento de sus UV (de [0, 1] a su celda). Las instancias de una malla comparten su celda.
+    columns = max(1, int(np.ceil(np.sqrt(len(meshes)))))
+    scale = 1.0 / columns
+    transforms = {}
+    for k, mesh in enumerate(meshes):
+        transforms[mesh.name] = (scale, ((k % columns) * scale, (k // columns) * scale))
+    return columns, transforms
+
+def get_segmentation_image(obj_name, i): #! devuelve la imagen de segmentación "i" del objeto, o la de su celda del atlas si el objeto se horneó en uno.
+    image = bpy.data.images.get(obj_name + "_" + str(i) + "_T_SegmentationMap")
+    obj = bpy.data.objects.get(obj_name)
+    if image is None and obj is not None and "segmentation_atlas" in obj:
+        image = bpy.data.images.get(obj["segmentation_atlas"]["cell_image"])
+    return image
+
+def crop_atlas_cell(atlas_pixels, name, scale, offset): #! copia la celda de un objeto del atlas en una imagen propia "name": la imagen de control queda alineada con las UV originales [0, 1] del material.
+    height, width = atlas_pixels.shape[:2]
+    x0, y0 = int(round(offset[0] * width)), int(round(offset[1] * height))
+    side = max(1, int(round(scale * width)))
+    cell = np.ones((min(side, height - y0), min(side, width - x0), 4), dtype=np.float32)
+    cell[..., :atlas_pixels.shape[2]] = atlas_pixels[y0:y0 + side, x0:x0 + side, :4]
+
+    tex_image = bpy.data.images.new(name=name, width=cell.shape[1], height=cell.shape[0])
+    tex_image.colorspace_settings.name = 'sRGB'
+    tex_image.filepath_raw = tex_image.name
+    tex_image.pixels.foreach_set(cell.ravel())
+    tex_image.pack()
+    return tex_image
+
+def atlas_bake(objects, mode=None): #! hornea en una sola pasada todos los objetos que comparten un material en un atlas compartido y le da a cada objeto la imagen de su celda.
+    mode = mode or SEGMENTATION_MODE
+    objects = [obj for obj in objects if obj.type == 'MESH']
+    if not objects:
+        return
+
+    folder_path = segmentation_export_folder()
+
+    bpy.context.view_layer.objects.active = objects[0]
+    bpy.ops.object.mode_set(mode='OBJECT')
+    for obj in objects:
+        prepare_segmentation_object(obj)
+
+    # Linked duplicates (same mesh) can only hold one UV layout: one cell, one temporary UV layer and attribute per mesh
+    owners = {} # nombre de malla -> primer objeto que la usa
+    for obj in objects:
+        owners.setdefault(obj.data.name, obj)
+    owners = list(owners.values())
+    columns, transforms = atlas_layout([obj.data for obj in owners])
+    size = min(max(bake_resolution(obj) for obj in objects) * columns, ATLAS_MAX_RESOLUTION)
+    atlas_name = objects[0].name + "_Atlas_T_SegmentationMap"
+    filepath = folder_path + atlas_name + "_BakedTexture.png"
+
+    # Same cache as the per-object maps, keyed by every mesh of the atlas in layout order
+    cache = get_segmentation_cache()
+    cache_key = None
+    if cache is not None:
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr(("ATLAS", size, columns)).encode())
+        for obj in owners:
+            digest.update(segmentation_cache_key(obj, mode, size).encode())
+        cache_key = digest.hexdigest()
+    cached = cache.load(cache_key, [atlas_name]) if cache is not None else None
+
+    if cached is not None:
+        tex_image = cached[0]
+        tex_image.save_render(filepath)
+        print("Atlas loaded from cache:", atlas_name)
+    elif mode == "RASTER":
+        pixels = None
+        for obj in owners:
+            random.seed(obj.name)
+            scale, offset = transforms[obj.data.name]
+            uv_tris, tri_faces = get_uv_triangles(obj.data)
+            labels = get_island_labels(obj.data)
+            island_colors = random_island_colors(int(labels.max()) + 1 if len(labels) else 0)
+            pixels = rasterize_uv_triangles(uv_tris * scale + np.array(offset, dtype=np.float32), island_colors[labels[tri_faces]], size, size, pixels)
+        tex_image = save_segmentation_image(atlas_name, pixels, filepath)
+    else:
+        tex_image = bpy.data.images.new(name=atlas_name, width=size, height=size)
+        restore = []
+        for obj in owners:
+            random.seed(obj.name)
+            mesh = obj.data
+            scale, offset = transforms[mesh.name]
+
+            # Temporary UV layer, initialised from the active one, moved into the mesh's cell
+            active_index = mesh.uv_layers.active_index
+            atlas_uv = mesh.uv_layers.new(name=ATLAS_UV_LAYER, do_init=True)
+            uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+            atlas_uv.data.foreach_get("uv", uvs)
+            atlas_uv.data.foreach_set("uv", (uvs.reshape(-1, 2) * scale + np.array(offset, dtype=np.float32)).ravel())
+            mesh.uv_layers.active = atlas_uv
+
+            material_indices = assign_island_color_attribute(obj, get_island_labels(mesh), tex_image)
+            restore.append((mesh, active_index, material_indices))
+
+        bpy.ops.object.select_all(action='DESELECT')
+        for obj in objects:
+            obj.select_set(True)
+        bpy.context.view_layer.objects.active = objects[0]
+
+        bpy.context.scene.render.engine = 'CYCLES'
+        bpy.context.scene.cycles.device = 'GPU'
+        bpy.context.scene.render.bake.use_pass_direct = False
+        bpy.context.scene.render.bake.use_pass_indirect = False
+        bpy.context.scene.render.bake.use_clear = False
+
+        bpy.ops.object.bake(type='DIFFUSE', save_mode='EXTERNAL')
+        tex_image.pack()
+        tex_image.save_render(filepath)
+
+        for mesh, active_index, material_indices in restore:
+            mesh.polygons.foreach_set("material_index", material_indices)
+            mesh.attributes.remove(mesh.attributes[ISLAND_COLOR_ATTRIBUTE])
+            mesh.uv_layers.remove(mesh.uv_layers[ATLAS_UV_LAYER])
+            mesh.uv_layers.active_index = active_index
+            mesh.update()
+        for obj in objects:
+            obj.select_set(False)
+        utils.restore_materials()
+
+    if cached is None and cache is not None:
+        cache.store(cache_key, [tex_image])
+
+    # Each object's control image is its own cell, cropped out of the atlas, so it lines up with the material's 0..1 UVs
+    width, height = tex_image.size
+    atlas_pixels = np.empty(width * height * tex_image.channels, dtype=np.float32)
+    tex_image.pixels.foreach_get(atlas_pixels)
+    atlas_pixels = atlas_pixels.reshape(height, width, tex_image.channels)
+    for obj in objects:
+        scale, offset = transforms[obj.data.name]
+        cell_image = crop_atlas_cell(atlas_pixels, segmentation_image_names(obj)[0], scale, offset)
+        obj["segmentation_atlas"] = {"image": atlas_name, "cell_image": cell_image.name, "scale": scale, "offset": list(offset)}
+
+    print("Atlas baked for {} objects ({} meshes): {}".format(len(objects), len(owners), atlas_name))
 
 def Material(obj):
 
@@ -236,14 +704,15 @@ def Material(obj):
         new_material.use_nodes = True
         obj.data.materials.append(new_material)
 
-def segmentation_map():
+def segmentation_map(workers=None, objects=None):
+    # objects: restrict the run to these objects (one streamed asset), None for the whole collections
+    workers = workers or SEGMENTATION_WORKERS
     bpy.context.scene.render.bake.margin = 0
 
-    # Create an empty dictionary to store material names and their associated objects
-    material_objects = {}
-
-    # Dictionary to store the UVs of each object
-    uv_dict = {}
+    # Objects to bake in order, and (source, target) pairs that reuse an already baked map
+    bake_plan = []
+    share_plan = []
+    atlas_plan = []
 
     # Get the "Imported Objects" collection
     imported_collection = bpy.data.collections.get("Imported Objects")
@@ -261,6 +730,9 @@ def segmentation_map():
 
     # Loop through each object in the "Imported Objects" collection
     tile_collection = tile_collection.objects
+    selected_names = None if objects is None else set(obj.name for obj in objects)
+    if selected_names is not None:
+        tile_collection = [obj for obj in tile_collection if obj.name in selected_names]
 
     for obj in tile_collection:
         num_materials = len(obj.material_slots)
@@ -273,50 +745,36 @@ def segmentation_map():
         else:
             print("tileable object has one material or more")
 
-    # Loop through each object
-    for obj in imported_collection.objects:
-        if obj.type == 'MESH':
-            # Get the mesh data of the object
-            mesh = obj.data
-
-            # Check if the object has UV data
-            if mesh.uv_layers.active is not None:
-                # Get the UV coordinates of the object
-                uvs = mesh.uv_layers.active.data
-                uv_coords = [uv.uv for uv in uvs]
-
-                # Check if this UV set has already been encountered
-                if str(uv_coords) in uv_dict:
-                    # Add the object to the list of objects with the same UV
-                    uv_dict[str(uv_coords)].append(obj)
-                else:
-                    # Add the UV set to the dictionary
-                    uv_dict[str(uv_coords)] = [obj]
-
-
-    # Loop through all objects in the scene
-    for obj in imported_collection.objects:
-        # Loop through all material slots in the object
-        for material_slot in obj.material_slots:
-            material = material_slot.material
-            if material:
-                # Check if the material name is already in the dictionary
-                if material.name in material_objects:
-                    # If it is, add the object to the list of objects associated with the material
-                    material_objects[material.name].append(obj)
-                else:
-                    # If it's not, add the material name to the dictionary and create a list with the object
-                    material_objects[material.name] = [obj]
+    # Material and UV fingerprint groups come from the persistent scene index, restricted to this collection
+    bpy.context.view_layer.update()
+    index = scene_index.get_scene_index()
+    imported_objects = {obj.name: obj for obj in imported_collection.objects if selected_names is None or obj.name in selected_names}
+    uv_fingerprints = index.object_uv
 
     # Create a list of material groups, where each group is a list of objects that share the same material
-    material_groups = [objs for objs in material_objects.values() if len(objs) > 1]
-
-    # Track whether we've already executed our code for objects that share multiple materials
-    code_executed = False
-
-    for uv_set in uv_dict:
-            if len(uv_dict[uv_set]) > 1:
-                print("Objects with the same UV: ", uv_dict[uv_set])
+    material_groups = []
+    for names in index.material_objects.values():
+        group = [imported_objects[name] for name in names if name in imported_objects]
+        if len(group) > 1:
+            material_groups.append(group)
+    grouped_objects = set(obj.name for group in material_groups for obj in group)
+
+    for names in index.uv_objects.values():
+        shared = [imported_objects[name] for name in names if name in imported_objects]
+        if len(shared) > 1:
+            print("Objects with the same UV: ", shared)
+
+    # Objects sharing a UV fingerprint, material slot count, topology and face->material assignment get the same map: bake the first, copy it to the rest
+    baked_objects = {}
+    face_layouts = {} # mesh name -> face_layout_hash, linked duplicates hash their mesh once
+
+    def share_key(obj):
+        fingerprint = uv_fingerprints.get(obj.name)
+        if fingerprint is None:
+            return None
+        if obj.data.name not in face_layouts:
+            face_layouts[obj.data.name] = face_layout_hash(obj.data)
+        return (fingerprint, len(obj.material_slots), face_layouts[obj.data.name])
 
     # Loop through the material groups and check if all objects in each group are using the same material
     for group in material_groups:
@@ -324,28 +782,60 @@ def segmentation_map():
         # Print the objects with the same UV
         if len(materials_used) == 1:
             print("Objects {} are sharing a single material: {}".format(group, list(materials_used)[0].name))
+            if ATLAS_BAKE:
+                atlas_plan.append(group)
+                continue
             obj= group[0]
-            generate_segmentation_map(obj)
-            bpy.ops.object.select_all(action='DESELECT')
+            bake_plan.append(obj)
+            baked_objects.setdefault(share_key(obj), obj)
+            # Linked duplicates (same mesh) in the group reuse the map instead of going without one
+            for other in group[1:]:
+                if other.data == obj.data:
+                    share_plan.append((obj, other))
 
         else:
-            # Only execute our code once, for the first group of objects that share multiple materials
-            if not code_executed and len(uv_dict[uv_set]) > 1:
-                print("Objects are sharing multiple materials")
-                # Do something here for objects that share multiple materials
-                # For example, print a list of the materials used by the objects
-                print("Materials used: {}".format([material.name for material in materials_used]))
-                code_executed = True
-                obj= group[0]
-                generate_segmentation_map(obj)
-                bpy.ops.object.select_all(action='DESELECT')
+            print("Objects are sharing multiple materials")
+            print("Materials used: {}".format([material.name for material in materials_used if material]))
+            # Deduplicated props land here with their shared materials: bake each unique mesh once, copy it to the others
+            for obj in group:
+                key = share_key(obj)
+                if key is not None and key in baked_objects:
+                    share_plan.append((baked_objects[key], obj))
+                    continue
+                bake_plan.append(obj)
+                if key is not None:
+                    baked_objects[key] = obj
 
     # Loop through all objects in the scene again, and do something for objects that do not share any materials with another object
-    for obj in imported_collection.objects:
-        if obj.type == 'MESH' and obj not in [o for group in material_groups for o in group]:
+    for obj in imported_objects.values():
+        if obj.type == 'MESH' and obj.name not in grouped_objects:
             # Do something here for objects that do not share any materials with another object
+            key = share_key(obj)
+            if key is not None and key in baked_objects:
+                share_plan.append((baked_objects[key], obj))
+                continue
+            bake_plan.append(obj)
+            if key is not None:
+                baked_objects[key] = obj
+
+    if workers > 1 and len(bake_plan) > 1:
+        parallel_bake = bpy.data.texts["parallel_bake.py"].as_module()
+        parallel_bake.bake_in_workers(bake_plan, workers, segmentation_config())
+    else:
+        for obj in bake_plan:
             generate_segmentation_map(obj)
             bpy.ops.object.select_all(action='DESELECT')
 
+    for group in atlas_plan:
+        atlas_bake(group)
+        bpy.ops.object.select_all(action='DESELECT')
+
+    for source, target in share_plan:
+        share_segmentation_maps(source, target)
+
+    cache = get_segmentation_cache()
+    if cache is not None:
+        print("Segmentation cache:", cache.stats())
+
 if __name__ == "__main__":
     tex_image = segmentation_map()
\ No newline at end of file
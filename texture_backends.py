@@ -0,0 +1,228 @@
+import bpy
+import os
+import abc
+import queue
+import threading
+import subprocess
+import numpy as np
+
+texture_worker = bpy.data.texts["texture_worker.py"].as_module()
+
+OUTPUT_IMAGE = "DreamTexture Output"
+WORKER_GENERATOR = "diffusers" # what texture_worker.py runs: "diffusers" (model kept loaded) or "stub"
+NAMESPACE_KEY = "texture_backend" # bpy.app.driver_namespace key: worker processes outlive a single run
+# Interpreter of the worker processes, "" for Blender's own. The "diffusers" generator needs numpy, torch, diffusers and Pillow:
+# the Dream Textures add-on keeps them in its DEPENDENCIES_DIR, which goes on the workers' PYTHONPATH when the add-on is installed,
+# otherwise point this at a Python that has them
+WORKER_PYTHON = ""
+ADDON_NAME = "dream_textures"
+DEPENDENCIES_DIR = ".python_dependencies"
+
+def pixels_to_image(name, pixels, width, height):
+    image = bpy.data.images.new(name, width=width, height=height, alpha=True)
+    image.pixels.foreach_set(pixels.ravel())
+    return image
+
+def image_to_pixels(image):
+    pixels = np.empty(len(image.pixels), dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels.reshape(image.size[1], image.size[0], image.channels)
+
+def rgba_pixels(image):
+    # The worker protocol is always RGBA
+    pixels = image_to_pixels(image)
+    if pixels.shape[2] == 4:
+        return pixels
+    rgba = np.ones(pixels.shape[:2] + (4,), dtype=np.float32)
+    rgba[..., :min(pixels.shape[2], 3)] = pixels[..., :3]
+    return rgba
+
+class TextureBackend(abc.ABC):
+    """Runs texture generations for the queue: submit() starts one, poll() returns the finished ones"""
+
+    slots = 1 # generations (or batches) it can run at the same time
+    batch_size = 1 # tasks submit_batch() runs as one generator call
+
+    @abc.abstractmethod
+    def submit(self, task_id, params, control_image):
+        pass
+
+    def submit_batch(self, tasks):
+        # tasks: [(task_id, params, control_image)] with the same model, size and settings
+        for task_id, params, control_image in tasks:
+            self.submit(task_id, params, control_image)
+
+    def poll(self):
+        # [(task_id, image or None on failure)]
+        return []
+
+    def alive(self):
+        return True
+
+    def close(self):
+        pass
+
+class DreamTexturesBackend(TextureBackend):
+    """The Dream Textures add-on operator. It reads the scene's dream_textures_prompt, so one generation at a time"""
+
+    def __init__(self):
+        self.task_id = None
+
+    def submit(self, task_id, params, control_image):
+        self.task_id = task_id
+        bpy.ops.shade.dream_texture()
+
+    def poll(self):
+        image = bpy.data.images.get(OUTPUT_IMAGE)
+        if self.task_id is None or image is None:
+            return []
+        task_id, self.task_id = self.task_id, None
+        return [(task_id, image)]
+
+class StubBackend(TextureBackend):
+    """Deterministic CPU textures computed in this process, for tests and benchmarks without a model"""
+
+    def __init__(self):
+        self.finished = []
+
+    def submit(self, task_id, params, control_image):
+        control = rgba_pixels(control_image) if control_image is not None else None
+        pixels = texture_worker.stub_texture(params, control)
+        self.finished.append((task_id, pixels))
+
+    def poll(self):
+        finished, self.finished = self.finished, []
+        return [(task_id, pixels_to_image(OUTPUT_IMAGE, pixels, pixels.shape[1], pixels.shape[0])) for task_id, pixels in finished]
+
+def addon_dependencies():
+    # Dependency folder of the installed Dream Textures add-on (an extension's module is "bl_ext.<repo>.dream_textures"), or None
+    import addon_utils
+    for module in addon_utils.modules():
+        if module.__name__.rsplit(".", 1)[-1] == ADDON_NAME:
+            path = os.path.join(os.path.dirname(module.__file__), DEPENDENCIES_DIR)
+            if os.path.isdir(path):
+                return path
+    return None
+
+def worker_environment():
+    env = dict(os.environ)
+    paths = [path for path in (addon_dependencies(), env.get("PYTHONPATH")) if path]
+    if paths:
+        env["PYTHONPATH"] = os.pathsep.join(paths)
+    return env
+
+class WorkerProcess:
+    def __init__(self, command, results, env=None):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.task_ids = set() # the batch it is generating
+        # Responses are read on a thread and handed to the main thread through "results"
+        self.reader = threading.Thread(target=self.read, args=(results,), daemon=True)
+        self.reader.start()
+
+    def read(self, results):
+        while True:
+            try:
+                header, payload = texture_worker.read_message(self.process.stdout)
+            except Exception as e:
+                # A garbled message: the stream can not be trusted any more, stop the worker
+                self.process.kill()
+                self.fail(results, "unreadable worker message: {!r}".format(e))
+                return
+            if header is None:
+                self.fail(results, "worker exited")
+                return
+            results.put((header, payload))
+
+    def fail(self, results, error):
+        for task_id in list(self.task_ids) or [None]:
+            results.put(({"id": task_id, "error": error}, b""))
+
+    def send(self, tasks):
+        self.task_ids = set(task_id for task_id, _, _ in tasks)
+        items = []
+        payload = []
+        for task_id, params, control_image in tasks:
+            items.append({"id": task_id, "params": params, "control": list(control_image.size) if control_image is not None else None})
+            if control_image is not None:
+                payload.append(rgba_pixels(control_image).tobytes())
+        texture_worker.write_message(self.process.stdin, {"items": items}, b"".join(payload))
+
+class WorkerBackend(TextureBackend):
+    """Persistent texture_worker.py processes that keep the model loaded; one batch per process at a time over its pipes"""
+
+    def __init__(self, workers=1, generator=None, batch_size=1):
+        module = bpy.data.texts["module.py"].as_module()
+        script = bpy.path.abspath(bpy.data.texts["texture_worker.py"].filepath)
+        command = [WORKER_PYTHON or module.findPythonBin(), script, generator or WORKER_GENERATOR]
+        env = worker_environment()
+        self.results = queue.Queue()
+        self.workers = [WorkerProcess(command, self.results, env) for _ in range(workers)]
+        self.slots = workers
+        self.batch_size = batch_size
+        print("[TEXTURE BACKEND] Started {} worker processes".format(workers))
+
+    def submit(self, task_id, params, control_image):
+        self.submit_batch([(task_id, params, control_image)])
+
+    def submit_batch(self, tasks):
+        # A worker can exit between poll() and here: the tasks then fail through poll() like any other
+        worker = next((worker for worker in self.workers if not worker.task_ids and worker.process.poll() is None), None)
+        if worker is None:
+            for task_id, _, _ in tasks:
+                self.results.put(({"id": task_id, "error": "no worker available"}, b""))
+            return
+        try:
+            worker.send(tasks)
+        except OSError as e:
+            worker.task_ids = set()
+            for task_id, _, _ in tasks:
+                self.results.put(({"id": task_id, "error": "worker exited: {!r}".format(e)}, b""))
+
+    def poll(self):
+        finished = []
+        while not self.results.empty():
+            header, payload = self.results.get()
+            if header["id"] is None:
+                continue
+            for worker in self.workers:
+                worker.task_ids.discard(header["id"])
+            if header.get("error"):
+                print("[TEXTURE BACKEND] Generation failed:", header["error"])
+                finished.append((header["id"], None))
+                continue
+            pixels = np.frombuffer(payload, dtype=np.float32)
+            finished.append((header["id"], pixels_to_image(OUTPUT_IMAGE, pixels, header["width"], header["height"])))
+        self.slots = sum(1 for worker in self.workers if worker.process.poll() is None)
+        return finished
+
+    def alive(self):
+        return any(worker.process.poll() is None for worker in self.workers)
+
+    def close(self):
+        for worker in self.workers:
+            if worker.process.poll() is None:
+                worker.process.stdin.close() # the worker exits when its input closes
+                worker.process.wait()
+
+def get_backend(kind, workers=1, batch_size=1):
+    # "DREAM_TEXTURES", "WORKER" or "STUB"; the worker processes are reused by later runs with the same configuration.
+    # Only the workers batch: the add-on operator and the stub generate one texture per call
+    backend = bpy.app.driver_namespace.get(NAMESPACE_KEY)
+    if backend is not None and backend.config == (kind, workers, batch_size) and backend.alive():
+        return backend
+    close_backend()
+
+    if kind == "WORKER":
+        backend = WorkerBackend(workers, batch_size=batch_size)
+    elif kind == "STUB":
+        backend = StubBackend()
+    else:
+        backend = DreamTexturesBackend()
+    backend.config = (kind, workers, batch_size)
+    bpy.app.driver_namespace[NAMESPACE_KEY] = backend
+    return backend
+
+def close_backend():
+    backend = bpy.app.driver_namespace.pop(NAMESPACE_KEY, None)
+    if backend is not None:
+        backend.close()
@@ -0,0 +1,57 @@
+import bpy
+import os
+import json
+import hashlib
+import threading
+
+image_cache = bpy.data.texts["image_cache.py"].as_module()
+
+JOURNAL_FILE = "journal.jsonl"
+
+class TextureJournal:
+    """Append-only record of finished texture generations, replayed by the next run to skip them"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = os.path.join(directory, JOURNAL_FILE)
+        self.lock = threading.Lock() # record() runs on the writer thread
+        self.entries = self.read()
+
+    def read(self):
+        # Later lines win: a material generated twice keeps its last result
+        entries = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # line torn by a crash mid-write
+                    if os.path.exists(os.path.join(self.directory, entry["file"])):
+                        entries[entry["material"]] = entry
+        except OSError:
+            pass
+        return entries
+
+    def lookup(self, material_name, signature):
+        # Path of the finished texture for this material, if it was made with the same parameters
+        entry = self.entries.get(material_name)
+        if entry is None or entry["signature"] != signature:
+            return None
+        return os.path.join(self.directory, entry["file"])
+
+    def record(self, material_name, signature, params, pixels, width, height, is_float):
+        # The pixel file is complete before its line is appended, so every line points to a usable file
+        digest = hashlib.blake2b((material_name + signature).encode(), digest_size=10).hexdigest()
+        name = digest + image_cache.pixels_file_suffix(is_float)
+        image_cache.save_pixels(os.path.join(self.directory, name), pixels, width, height)
+
+        entry = {"material": material_name, "signature": signature, "params": params, "file": name}
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[material_name] = entry
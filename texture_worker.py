@@ -0,0 +1,230 @@
+import sys
+import json
+import struct
+import hashlib
+import numpy as np
+
+# Out-of-process texture generator. Runs under plain Python (no bpy), started by texture_backends.WorkerBackend:
+#   python texture_worker.py [stub|diffusers]
+# Messages on stdin/stdout: 12-byte length prefix, JSON header, raw float32 RGBA pixels (Blender's bottom-up row order).
+# A request is a batch: {"items": [{"id", "params", "control": [width, height] or None}]}, the control images one after the
+# other in the payload. Each item gets its own response: {"id", "width", "height"} and its pixels, or {"id", "error"}
+
+MESSAGE_PREFIX = struct.Struct("<IQ") # header length, payload length
+
+# Dream Textures model names that are not Hugging Face ids
+MODEL_ALIASES = {"v1-5-pruned-emaonly": "runwayml/stable-diffusion-v1-5"}
+
+# Dream Textures scheduler names -> diffusers scheduler class, extra config
+SCHEDULERS = {
+    "DDIM": ("DDIMScheduler", {}),
+    "DDPM": ("DDPMScheduler", {}),
+    "DEIS Multistep": ("DEISMultistepScheduler", {}),
+    "DPM Solver Multistep": ("DPMSolverMultistepScheduler", {}),
+    "DPM Solver Multistep Karras": ("DPMSolverMultistepScheduler", {"use_karras_sigmas": True}),
+    "DPM Solver Singlestep": ("DPMSolverSinglestepScheduler", {}),
+    "DPM Solver Singlestep Karras": ("DPMSolverSinglestepScheduler", {"use_karras_sigmas": True}),
+    "Euler Discrete": ("EulerDiscreteScheduler", {}),
+    "Euler Ancestral Discrete": ("EulerAncestralDiscreteScheduler", {}),
+    "Heun Discrete": ("HeunDiscreteScheduler", {}),
+    "KDPM2 Discrete": ("KDPM2DiscreteScheduler", {}),
+    "KDPM2 Ancestral Discrete": ("KDPM2AncestralDiscreteScheduler", {}),
+    "LMS Discrete": ("LMSDiscreteScheduler", {}),
+    "PNDM": ("PNDMScheduler", {}),
+}
+SEAMLESS_AXES = {"off": "", "x": "x", "y": "y", "xy": "xy"} # Dream Textures seamless_axes -> circular padding axes
+PROMPT_STRUCTURES = ("custom",) # structures whose prompt is just the subject token
+ITEM_PARAMETERS = ("seed", "prompt_structure_token_subject", "use_negative_prompt", "negative_prompt", "control_nets") # may differ within a batch
+
+def read_exact(stream, length):
+    data = b""
+    while len(data) < length:
+        chunk = stream.read(length - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def read_message(stream):
+    prefix = read_exact(stream, MESSAGE_PREFIX.size)
+    if prefix is None:
+        return None, None
+    header_length, payload_length = MESSAGE_PREFIX.unpack(prefix)
+    data = read_exact(stream, header_length)
+    payload = read_exact(stream, payload_length) if payload_length else b""
+    if data is None or payload is None:
+        return None, None # the stream ended mid-message
+    return json.loads(data.decode("utf-8")), payload
+
+def write_message(stream, header, payload=b""):
+    data = json.dumps(header, default=str).encode("utf-8")
+    stream.write(MESSAGE_PREFIX.pack(len(data), len(payload)))
+    stream.write(data)
+    stream.write(payload)
+    stream.flush()
+
+def stub_texture(params, control=None):
+    # Deterministic stand-in for a model: same parameters (control image hash included), same pixels
+    width = int(params.get("width") or 512)
+    height = int(params.get("height") or 512)
+    seed = int(hashlib.blake2b(json.dumps(params, sort_keys=True, default=str).encode(), digest_size=8).hexdigest(), 16)
+    rng = np.random.default_rng(seed)
+
+    rgb = rng.random(3, dtype=np.float32) * 0.6 + 0.2 + (rng.random((height, width, 1), dtype=np.float32) - 0.5) * 0.2
+    if control is not None:
+        # Nearest-neighbour resample of the control image so its islands show through
+        ys = np.arange(height) * control.shape[0] // height
+        xs = np.arange(width) * control.shape[1] // width
+        rgb = rgb * 0.7 + control[ys][:, xs, :3] * 0.3
+
+    pixels = np.ones((height, width, 4), dtype=np.float32)
+    pixels[..., :3] = np.clip(rgb, 0.0, 1.0)
+    return pixels
+
+def hub_id(name):
+    # "models--lllyasviel--control_v11p_sd15_seg" (Hugging Face cache folder name) -> "lllyasviel/control_v11p_sd15_seg"
+    if name.startswith("models--"):
+        return name[len("models--"):].replace("--", "/")
+    return MODEL_ALIASES.get(name, name)
+
+def seamless_conv_forward(conv, axes):
+    # Conv2d forward with circular padding along the seamless axes, zeros along the others
+    import torch.nn.functional as F
+    pad_y, pad_x = conv.padding
+
+    def conv_forward(input, weight, bias):
+        input = F.pad(input, (pad_x, pad_x, 0, 0), mode="circular" if "x" in axes else "constant")
+        input = F.pad(input, (0, 0, pad_y, pad_y), mode="circular" if "y" in axes else "constant")
+        return F.conv2d(input, weight, bias, conv.stride, 0, conv.dilation, conv.groups)
+    return conv_forward
+
+class DiffusersGenerator:
+    """Stable Diffusion, with the segmentation ControlNet when there is a control image; pipelines stay loaded between requests"""
+
+    def __init__(self):
+        import torch
+        self.torch = torch
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.dtype = torch.float16 if self.device == "cuda" else torch.float32
+        self.pipelines = {}
+        self.settings = {} # pipeline key -> (scheduler, seamless axes) it is set up for
+
+    def pipeline(self, model, control_net):
+        key = (model, control_net)
+        if key not in self.pipelines:
+            from diffusers import StableDiffusionPipeline, StableDiffusionControlNetPipeline, ControlNetModel
+            if control_net:
+                controlnet = ControlNetModel.from_pretrained(hub_id(control_net), torch_dtype=self.dtype)
+                pipeline = StableDiffusionControlNetPipeline.from_pretrained(hub_id(model), controlnet=controlnet, torch_dtype=self.dtype)
+            else:
+                pipeline = StableDiffusionPipeline.from_pretrained(hub_id(model), torch_dtype=self.dtype)
+            self.pipelines[key] = pipeline.to(self.device)
+        return self.pipelines[key]
+
+    def configure(self, key, scheduler, axes):
+        # Swap the scheduler and the convolution padding only when the request asks for other ones than the last
+        if self.settings.get(key) == (scheduler, axes):
+            return
+        import diffusers
+        pipeline = self.pipelines[key]
+        name, config = SCHEDULERS[scheduler]
+        pipeline.scheduler = getattr(diffusers, name).from_config(pipeline.scheduler.config, **config)
+        for model in (pipeline.unet, pipeline.vae):
+            for module in model.modules():
+                if isinstance(module, self.torch.nn.Conv2d) and module.padding != (0, 0):
+                    if axes:
+                        module._conv_forward = seamless_conv_forward(module, axes)
+                    else:
+                        module.__dict__.pop("_conv_forward", None)
+        self.settings[key] = (scheduler, axes)
+
+    def __call__(self, params, control=None):
+        return self.batch([params], [control])[0]
+
+    def batch(self, params_list, controls):
+        # One pipeline call for the whole batch: prompt, seed and control image per item, everything else shared
+        from PIL import Image
+        params = params_list[0]
+        shared = [({name: value for name, value in p.items() if name not in ITEM_PARAMETERS}, control_setup(p, c)) for p, c in zip(params_list, controls)]
+        if any(setup != shared[0] for setup in shared[1:]):
+            raise ValueError("batch items need the same model, size, settings and ControlNet")
+
+        # Settings the worker can not reproduce fail the request instead of silently generating something else
+        scheduler = params.get("scheduler") or "DDIM"
+        if scheduler not in SCHEDULERS:
+            raise ValueError("unsupported scheduler: {}".format(scheduler))
+        axes = SEAMLESS_AXES.get(params.get("seamless_axes") or "off")
+        if axes is None:
+            raise ValueError("unsupported seamless axes: {}".format(params.get("seamless_axes")))
+        if (params.get("prompt_structure") or "custom") not in PROMPT_STRUCTURES:
+            raise ValueError("unsupported prompt structure: {}".format(params.get("prompt_structure")))
+
+        control_net, scale = shared[0][1]
+        pipeline = self.pipeline(params["model"], control_net)
+        self.configure((params["model"], control_net), scheduler, axes)
+
+        kwargs = {
+            "prompt": [p.get("prompt_structure_token_subject") or "" for p in params_list],
+            "negative_prompt": [(p.get("negative_prompt") or "") if p.get("use_negative_prompt", True) else "" for p in params_list],
+            "num_inference_steps": int(params.get("steps") or 15),
+            "guidance_scale": float(params.get("cfg_scale") or 7),
+            "width": int(params.get("width") or 512),
+            "height": int(params.get("height") or 512),
+            "generator": [self.torch.Generator(self.device).manual_seed(int(p.get("seed") or 0)) for p in params_list],
+        }
+        if control_net:
+            # Blender rows are bottom-up
+            kwargs["image"] = [Image.fromarray((np.clip(control[::-1, :, :3], 0.0, 1.0) * 255).astype(np.uint8)) for control in controls]
+            kwargs["controlnet_conditioning_scale"] = float(scale)
+
+        images = []
+        for image in pipeline(**kwargs).images:
+            pixels = np.asarray(image.convert("RGBA"), dtype=np.float32) / 255.0
+            images.append(np.ascontiguousarray(pixels[::-1]))
+        return images
+
+def control_setup(params, control):
+    # (ControlNet model, conditioning scale) the item generates with, (None, None) without a control image
+    control_nets = params.get("control_nets") or []
+    if control_nets and control is not None:
+        return control_nets[0][0], control_nets[0][1]
+    return None, None
+
+def read_controls(items, payload):
+    controls = []
+    offset = 0
+    for item in items:
+        if not item.get("control"):
+            controls.append(None)
+            continue
+        width, height = item["control"]
+        controls.append(np.frombuffer(payload, dtype=np.float32, count=width * height * 4, offset=offset).reshape(height, width, 4))
+        offset += width * height * 4 * 4
+    return controls
+
+def main():
+    generator = DiffusersGenerator() if sys.argv[1:2] == ["diffusers"] else stub_texture
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    sys.stdout = sys.stderr # library prints must not end up in the message stream
+
+    while True:
+        header, payload = read_message(stdin)
+        if header is None:
+            break # the parent closed the pipe
+        items = header["items"]
+        try:
+            params_list = [item["params"] for item in items]
+            controls = read_controls(items, payload)
+            if hasattr(generator, "batch"):
+                images = generator.batch(params_list, controls)
+            else:
+                images = [generator(params, control) for params, control in zip(params_list, controls)]
+        except Exception as e:
+            for item in items:
+                write_message(stdout, {"id": item["id"], "error": repr(e)})
+            continue
+        for item, pixels in zip(items, images):
+            write_message(stdout, {"id": item["id"], "width": pixels.shape[1], "height": pixels.shape[0]}, pixels.astype(np.float32).tobytes())
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,21 @@
 import bpy # módulo de Python que proporciona acceso a la API de Blender
 import os  # libreria que permite acceder a funciones con el sistema operativo.
+import json # libreria para leer y escribir archivos JSON (los .gltf son JSON).
+import hashlib # libreria para calcular hashes del contenido de los archivos.
+import urllib.parse # libreria para decodificar las rutas (URI) de los recursos externos de un .gltf.
+import sys # libreria para leer los argumentos con los que se lanzó Blender.
+import subprocess # libreria para lanzar procesos de Blender en segundo plano.
+import tempfile # libreria para crear archivos temporales.
+import numpy as np # libreria para leer los datos de las mallas en bloque (foreach_get).
+from mathutils import Matrix # matrices de Blender, para aplicar la escala directamente a las mallas.
+
+TILEABLE_KEYWORDS = ['wall', 'ceiling', 'floor', 'tile'] # palabras en el nombre del archivo o del objeto que indican que es un asset "tileable".
+GLTF_CACHE_DIR = ".gltf_cache" # carpeta (dentro del directorio de importación) donde se guarda cada asset ya procesado como una librería .blend.
+QUARANTINE_BAD_GLTF = False # True: los archivos que el pre-escaneo no puede leer se mueven a la carpeta "quarantine" en lugar de solo omitirse.
+GLTF_IMPORT_WORKERS = 1 # cantidad de procesos "blender -b" que importan archivos en paralelo, 1 para importar todo en esta instancia.
+
+# expresión que ejecuta cada proceso de importación: carga este archivo como texto y llama a "ingest_worker"
+GLTF_WORKER_EXPR = 'import bpy, sys; bpy.data.texts.load(sys.argv[sys.argv.index("--") + 1]).as_module().ingest_worker()'
 
 def cleanup():  #! función de limpieza 
 
@@ -31,6 +47,23 @@ def cleanup():  #! función de limpieza
         if block.users == 0: # si no existen referencias de algún objeto en las imagenes, remueve la escena.
             bpy.data.images.remove(block)
            
+def cleanup_objects(objects, image_names=()): #! limpieza limitada a "objects": solo elimina los materiales temporales "_new" de sus horneados y las imágenes "image_names" que quedaron sin usuarios. El resto del archivo (otros assets en proceso) no se toca.
+    object_names = set(obj.name for obj in objects)
+    material_names = set(slot.material.name for obj in objects for slot in obj.material_slots if slot.material)
+
+    def baked_for_objects(name): # materiales "_new" que crean multiple_bake, assign_island_materials y assign_island_color_attribute para estos objetos.
+        if not name.endswith("_new"):
+            return False
+        return name[:-4] in material_names or any(name.startswith("Island_" + obj_name + "_") or name == "Islands_" + obj_name + "_new" for obj_name in object_names)
+
+    for block in [block for block in bpy.data.materials if block.users == 0 and baked_for_objects(block.name)]:
+        bpy.data.materials.remove(block)
+
+    for name in image_names:
+        block = bpy.data.images.get(name)
+        if block is not None and block.users == 0:
+            bpy.data.images.remove(block)
+
 def merge(obj): #!función para fusionar objetos
     
     merge_threshold = 0.0001 # establece el umbral (valor limite o punto de corte) de distancia para la fusión
@@ -61,17 +94,307 @@ def merge(obj): #!función para fusionar objetos
 
     obj.select_set(False) # deselecciona el objeto "obj"
     
-def import_gltf_files(directory): #!función que importa archivos GTLF o GLB desde un directorio especifico de Blender (se utiliza en DREAM_TEXTURES.py)
-    #? GTLF (GL Transmission Format) = formato de archivo de texto basado en JSON que almacena información del modelado 3D (geometría, texturas, animaciones, etc).
-    #? GLB (GL Binary): variante binaria del GTLF, pero este almacena los datos del modelo 3D y sus recursos(texturas, imagenes, etc) en un solo archivo binario. 
-      
-    #? listdir = funcion de Python para obtener una lista de nombres de archivos y directorios contenidos en una ruta especifica.
-    files = os.listdir(directory)
+def is_tileable(file, object_name): #! verifica si el nombre del archivo o el nombre del objeto contiene alguna de las palabras de "TILEABLE_KEYWORDS"
+    return any(keyword in file.lower() or keyword in object_name.lower() for keyword in TILEABLE_KEYWORDS)
+
+def gltf_file_hash(file_path): #! calcula un hash del contenido del archivo y, en un .gltf, también de los .bin e imágenes externos que referencia.
+    digest = hashlib.blake2b(digest_size=20)
+    paths = [file_path]
+
+    if file_path.lower().endswith('.gltf'):
+        try:
+            with open(file_path, encoding='utf-8') as f:
+                gltf = json.load(f)
+        except ValueError:
+            gltf = {}
+        for resource in gltf.get('buffers', []) + gltf.get('images', []):
+            uri = resource.get('uri')
+            if uri and not uri.startswith('data:'): # los recursos "data:" ya están dentro del JSON
+                paths.append(os.path.join(os.path.dirname(file_path), urllib.parse.unquote(uri)))
+
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''): # lee el archivo por bloques de 1 MB
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def import_gltf_file(file_path): #! importa un archivo GLTF/GLB y prepara sus objetos (escala aplicada y materiales con nodos). Devuelve los objetos importados.
+    bpy.ops.import_scene.gltf(filepath=file_path) # importa el archivo de la ruta completa.
+
+    imported_objects = list(bpy.context.selected_objects) # obtiene todos los objetos seleccionados en el contexto actual y los asigna a la variable.
+
+    apply_scale(imported_objects) # cualquier escala no uniforme que se haya aplicado al objeto se convertirá en una escala uniforme de 1. en los ejes X, Y, Z.
+    prepare_materials(imported_objects)
+
+    return imported_objects
+
+def parent_depth(obj): #! cantidad de padres por encima del objeto (0 si no tiene padre).
+    depth = 0
+    while obj.parent is not None:
+        obj = obj.parent
+        depth += 1
+    return depth
+
+def apply_scale(objects): #! aplica la escala de todos los objetos a sus datos de una vez, con el mismo resultado que "transform_apply(scale=True)" pero sin una llamada al operador por objeto.
+    #? transform_apply = operador de Blender que aplica las transformaciones de ubicacion, rotacion y escala de un objeto.
+    #? mesh.transform = multiplica todos los vértices de la malla (y sus shape keys) por una matriz; es la misma función que usa el operador.
+    bpy.context.view_layer.update() # asegura que "matrix_world" esté calculada para todos los objetos importados.
+    worlds = {obj.name: obj.matrix_world.copy() for obj in objects} # matrices de mundo antes de cambiar nada.
+
+    fallback = [] # objetos que el operador sabe tratar y este camino no (cámaras, curvas, mallas compartidas, escala 0)
+    for obj in sorted(objects, key=parent_depth): # los padres primero, como los ordena el importador de GLTF.
+        scale = [a * b for a, b in zip(obj.scale, obj.delta_scale)]
+        if scale == [1.0, 1.0, 1.0]:
+            continue
+        if 0.0 in scale:
+            fallback.append(obj)
+            continue
 
-    #? lower = convierte todos los caracteres de la cadena a minusculas.
-    #? endswith = verifica si la cadena termina con un sufijo o conjutno de sufijos especificos.
-    gltf_files = [file for file in files if file.lower().endswith(('.gltf', '.glb'))] # Filtra los archivos según su formato (.gltf o .glb) y los guarda en un arreglo.
+        if obj.type == 'MESH' and obj.data.users == 1:
+            obj.data.transform(Matrix.Diagonal(scale).to_4x4()) # escala los vértices en el espacio local del objeto.
+        elif obj.type == 'EMPTY':
+            obj.empty_display_size *= max(abs(s) for s in scale) # los empties no tienen datos: el operador escala su tamaño de dibujo.
+        else:
+            fallback.append(obj)
+            continue
+
+        obj.scale = (1.0, 1.0, 1.0)
+        obj.delta_scale = (1.0, 1.0, 1.0)
+        world = worlds[obj.name] @ Matrix.Diagonal([1.0 / s for s in scale]).to_4x4()
+        worlds[obj.name] = world
+
+        # Igual que el operador: los hijos no se mueven, su transformación pasa a ser la de mundo y la inversa del padre se recalcula
+        for child in obj.children:
+            child_world = worlds.get(child.name, child.matrix_world.copy())
+            child.matrix_parent_inverse = world.inverted_safe()
+            child.matrix_basis = child_world
+
+    if fallback:
+        bpy.ops.object.select_all(action='DESELECT')
+        for obj in fallback:
+            obj.select_set(True)
+        bpy.context.view_layer.objects.active = fallback[0]
+        bpy.ops.object.transform_apply(location=False, rotation=False, scale=True)
+        for obj in objects:
+            obj.select_set(True) # deja la selección como la dejó la importación.
+
+def prepare_materials(objects): #! activa los nodos y deselecciona todos los nodos de cada material, una sola vez por material aunque lo compartan varios objetos.
+    #? material_slots = son espacios reservados en un objeto donde se pueden asignar y administrar los materiales que se aplicarán a las partes individuales del objeto.
+    #? use_nodes = propiedad del material que indica si el material utiliza nodos para su configuracion. 
+    materials = {slot.material.name: slot.material for obj in objects for slot in obj.material_slots if slot.material is not None}
+    for material in materials.values():
+        material.use_nodes = True  # edición con nodos permitida.
+        nodes = material.node_tree.nodes
+        nodes.foreach_set("select", [False] * len(nodes)) # deselecciona todos los nodos del arbol de una vez, preparandolos para futuras modificaciones.
+
+def image_content_hash(image): #! hash del contenido de una imagen: los datos empaquetados, o el archivo en disco; el nombre solo si no hay ninguno de los dos.
+    if image.packed_file is not None:
+        return hashlib.blake2b(image.packed_file.data, digest_size=16).hexdigest()
+    path = bpy.path.abspath(image.filepath)
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    return image.name
+
+def socket_value(socket): #! valor por defecto de un socket como texto; los sockets de shader no tienen valor.
+    value = getattr(socket, "default_value", None)
+    return repr(tuple(value)) if hasattr(value, "__len__") and not isinstance(value, str) else repr(value)
+
+def material_content_hash(material, image_hashes=None): #! hash de lo que el material es (nodos, valores, enlaces e imágenes), no de su nombre: "Mat" de dos archivos distintos puede ser otro material.
+    #? image_hashes = diccionario imagen -> hash, para no leer dos veces la misma imagen.
+    if image_hashes is None:
+        image_hashes = {}
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((tuple(material.diffuse_color), material.blend_method, material.use_backface_culling)).encode())
+    if material.use_nodes and material.node_tree is not None:
+        for node in sorted(material.node_tree.nodes, key=lambda node: node.name):
+            # los nombres de los nodos son propios del material: la importación repite los mismos en cada copia
+            settings = [(prop.identifier, getattr(node, prop.identifier)) for prop in node.bl_rna.properties if prop.type == 'ENUM' and not prop.is_readonly]
+            digest.update(repr((node.name, node.bl_idname, settings, [socket_value(socket) for socket in node.inputs])).encode())
+            image = getattr(node, "image", None)
+            if image is not None:
+                if image.name not in image_hashes:
+                    image_hashes[image.name] = image_content_hash(image)
+                digest.update(image_hashes[image.name].encode())
+        links = sorted((link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier) for link in material.node_tree.links)
+        digest.update(repr(links).encode())
+    return digest.hexdigest()
+
+def mesh_geometry_hash(mesh, material_hashes=None, image_hashes=None): #! hash de la geometría de la malla: posiciones, topología, UV, normales personalizadas y materiales. Dos mallas con el mismo hash son idénticas.
+    #? material_hashes = diccionario nombre del material -> material_content_hash, compartido entre las mallas de una misma deduplicación.
+    if material_hashes is None:
+        material_hashes = {}
+    digest = hashlib.blake2b(digest_size=16)
+    #? foreach_get = copia una propiedad de todos los elementos de una colección a un buffer, sin recorrerlos uno por uno en Python.
+    buffers = [
+        (mesh.vertices, "co", np.float32, 3),
+        (mesh.edges, "vertices", np.int32, 2),
+        (mesh.loops, "vertex_index", np.int32, 1),
+        (mesh.polygons, "loop_start", np.int32, 1),
+        (mesh.polygons, "loop_total", np.int32, 1),
+        (mesh.polygons, "material_index", np.int32, 1),
+        (mesh.polygons, "use_smooth", bool, 1),
+    ]
+    buffers += [(uv_layer.data, "uv", np.float32, 2) for uv_layer in mesh.uv_layers]
+    if mesh.has_custom_normals:
+        if hasattr(mesh, "corner_normals"): # Blender 4.1+
+            buffers.append((mesh.corner_normals, "vector", np.float32, 3))
+        else:
+            mesh.calc_normals_split()
+            buffers.append((mesh.loops, "normal", np.float32, 3))
+
+    for collection, prop, dtype, size in buffers:
+        buffer = np.empty(len(collection) * size, dtype=dtype)
+        collection.foreach_get(prop, buffer)
+        digest.update(str(len(collection)).encode()) # el tamaño separa un buffer del siguiente.
+        digest.update(buffer.tobytes())
+
+    digest.update("|".join(uv_layer.name for uv_layer in mesh.uv_layers).encode())
+    # por contenido: el mismo prop importado de otro archivo trae "Mat.001" en lugar de "Mat", y otro "Mat" puede ser un material distinto
+    for material in mesh.materials:
+        if material is not None and material.name not in material_hashes:
+            material_hashes[material.name] = material_content_hash(material, image_hashes)
+    digest.update("|".join(material_hashes[material.name] if material else "" for material in mesh.materials).encode())
+    return digest.hexdigest()
+
+def deduplicate_meshes(objects): #! convierte los objetos con mallas idénticas en instancias (comparten el mismo datablock de malla) y elimina las copias. Devuelve la cantidad de mallas eliminadas.
+    unique_meshes = {} # hash -> primera malla con esa geometría
+    material_hashes = {}
+    image_hashes = {}
+    duplicates = []
+    for obj in objects:
+        # las shape keys no entran en el hash: esas mallas se quedan como están
+        if obj.type != 'MESH' or obj.data.shape_keys is not None:
+            continue
+        mesh = unique_meshes.setdefault(mesh_geometry_hash(obj.data, material_hashes, image_hashes), obj.data)
+        if mesh != obj.data:
+            duplicates.append(obj.data)
+            obj.data = mesh # ahora el objeto es una instancia de la malla única.
+
+    removed = 0
+    for mesh in set(duplicates):
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+            removed += 1
+    print("[DEDUP] {} unique meshes, {} duplicates removed".format(len(unique_meshes), removed))
+    return removed
+
+def write_gltf_library(library_path, objects): #! guarda los objetos ya procesados (con sus mallas, materiales e imágenes) en una librería .blend.
+    tmp_path = library_path + ".tmp"
+    bpy.data.libraries.write(tmp_path, set(objects), path_remap='ABSOLUTE', compress=True)
+    os.replace(tmp_path, library_path) # la librería solo aparece completa, aunque el proceso se interrumpa.
+
+def load_gltf_library(library_path): #! añade (append) a la escena los objetos guardados en una librería .blend. Devuelve los objetos añadidos.
+    #? libraries.load = abre un archivo .blend para leer sus datablocks; con "link=False" se copian (append) al archivo actual.
+    with bpy.data.libraries.load(library_path, link=False) as (data_from, data_to):
+        data_to.objects = data_from.objects
+    return [obj for obj in data_to.objects if obj is not None]
+
+def ingest_worker(): #! se ejecuta dentro de cada proceso "blender -b": importa su parte de los archivos y guarda cada uno como librería .blend en la caché.
+    argv = sys.argv[sys.argv.index("--") + 1:] # los argumentos después de "--" son para el script, no para Blender.
+    with open(argv[1]) as f:
+        shard = json.load(f) # lista de [ruta del archivo, ruta de su librería]
+
+    for file_path, library_path in shard:
+        if os.path.exists(library_path):
+            continue
+        imported_objects = import_gltf_file(file_path)
+        if imported_objects:
+            write_gltf_library(library_path, imported_objects)
+            bpy.data.batch_remove(imported_objects) # libera la escena del proceso antes del siguiente archivo.
+            bpy.data.orphans_purge(do_recursive=True)
+        print("[IMPORT WORKER] Imported:", file_path)
+
+def split_by_cost(items, workers, costs): #! reparte los archivos entre los procesos equilibrando su costo estimado: el más costoso primero, al proceso con menos carga.
+    shards = [[] for _ in range(workers)]
+    loads = [0] * workers
+    for file_path, library_path in sorted(items, key=lambda item: costs[item[0]], reverse=True):
+        k = loads.index(min(loads))
+        shards[k].append([file_path, library_path])
+        loads[k] += costs[file_path]
+    return [shard for shard in shards if shard]
+
+def ingest_in_workers(library_paths, workers, costs=None): #! importa en paralelo los archivos que aún no están en la caché, con varios procesos "blender -b" que escriben sus librerías .blend.
+    missing = [(file_path, library_path) for file_path, library_path in library_paths.items() if not os.path.exists(library_path)]
+    if not missing:
+        return
+
+    script_path = bpy.path.abspath(bpy.data.texts["utils.py"].filepath) if "utils.py" in bpy.data.texts else ""
+    if not script_path or not os.path.exists(script_path):
+        script_path = os.path.join(os.path.dirname(bpy.data.filepath), "utils.py") # la carpeta de los scripts (ver import_scripts.py)
+
+    processes = []
+    shard_files = []
+    if costs is None:
+        costs = {file_path: os.path.getsize(file_path) for file_path, _ in missing} # sin pre-escaneo, el tamaño del archivo es el costo.
+
+    for shard in split_by_cost(missing, workers, costs):
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump(shard, f) # la lista va en un archivo: miles de rutas no caben en la línea de comandos.
+        shard_files.append(f.name)
+        command = [bpy.app.binary_path, "-b", "--factory-startup", "--python-expr", GLTF_WORKER_EXPR, "--", script_path, f.name]
+        processes.append(subprocess.Popen(command))
+    print("[IMPORT] {} files across {} workers".format(len(missing), len(processes)))
+
+    for process in processes:
+        if process.wait() != 0:
+            print("[IMPORT] Worker exited with code", process.returncode) # sus archivos se importan luego en esta instancia.
+    for shard_file in shard_files:
+        os.remove(shard_file)
+
+def link_imported_object(imported_object, file, tile_collection, imported_collection, tileable=None): #! renombra el objeto importado y lo mueve a la colección "Tileable Objects" o "Imported Objects".
+    #? tileable = clasificación del pre-escaneo (gltf_scan.import_tileable): True o False para todo el archivo, None para revisar el nombre del objeto.
+    imported_file_name = imported_object.name # del objeto recibido por el bucle se guarda el nombre en la variable "imported_file_name"
+
+    new_object_name = imported_file_name.replace(".", "_") # reemplaza los puntos (".") por barra baja ("_") en el nombre del objeto.
+
+    imported_object.name = new_object_name # renombra el objeto importado con el nombre modificado
+
+    print("Original object name:", imported_file_name) # nombre original del objeto.
+    print("Modified object name:", new_object_name) # nombre modificado del objeto
+
+    #? unlink = permite gestionar pertenencia de los objetos a las colecciones en Blender, permitiendo agregar o quitar objetos de una coleccion sin eliminarlos de la escena.
+    for collection in imported_object.users_collection:
+        collection.objects.unlink(imported_object) # desvincula el objeto de las colecciones a las que está vinculado.
+
+    # Check if the file name or modified object name contains specific words
+    if tileable is None:
+        tileable = is_tileable(file, new_object_name) # verifica si el nombre del archivo o el nombre modificado del objeto contiene palabras especificas.
+    if tileable:
+        print("This is a tileable asset") 
+        print(file)
+        #? link = vincula objetos a una colección.
+        tile_collection.objects.link(imported_object)  # vincula el objeto a la colección de azulejo.
+    else:
+        imported_collection.objects.link(imported_object)  # vincula el objeto a la colección de importaciones.
+
+    print()
+
+def import_gltf_asset(file_path, tile_collection, imported_collection, library_path=None, tileable=None): #! importa un solo archivo (o lo añade desde su librería .blend) y lo enlaza a las colecciones. Devuelve los objetos importados.
+    file = os.path.basename(file_path)
 
+    if library_path and os.path.exists(library_path): # el archivo no cambió desde la última importación: se añade desde la librería, sin volver a leer el GLTF.
+        imported_objects = load_gltf_library(library_path)
+        print("Loaded from cache:", file)
+    else:
+        imported_objects = import_gltf_file(file_path)
+        if library_path and imported_objects:
+            write_gltf_library(library_path, imported_objects)
+
+    if len(imported_objects) == 0: # si no hay archivos para importar.
+        print("Warning: No objects found in file:", file)
+        return imported_objects
+
+    print("Imported file:", file) # imprime el nombre del archivo.
+    print("Imported object names:", [obj.name for obj in imported_objects]) # imprime el nombre de los objetos que contiene el archivo.
+
+    for imported_object in imported_objects: # de manera de bucle recibe el objeto
+        link_imported_object(imported_object, file, tile_collection, imported_collection, tileable)
+    return imported_objects
+
+def get_import_collections(): #! devuelve las colecciones "Tileable Objects" e "Imported Objects", creándolas si no existen.
     name_imported = "Imported Objects" # definimos la variable "name_imported"
 
     #? collections = contenedor que agrupa objetos relacionados
@@ -95,68 +418,60 @@ def import_gltf_files(directory): #!función que importa archivos GTLF o GLB des
     else:
         print("Collection 'Tileable Objects' already exists")
 
-    # por cada archivo .GLTF o .GLB se realiza una importación
-    for file in gltf_files: #gtlf es el arreglo donde se guardaran los archivos con extensión gtlf y glb encontrados en la ruta especificada.
-        file_path = os.path.join(directory, file) # une el directorio con el nombre del archivo para crear una ruta completa
-        bpy.ops.import_scene.gltf(filepath=file_path) # importa el archivo de la ruta completa.
-
-        imported_objects = bpy.context.selected_objects # obtiene todos los objetos seleccionados en el contexto actual y los asigna a la variable.
-        
-        if len(imported_objects) == 0: # si no hay archivos para importar.
-            print("Warning: No objects found in file:", file)
-            continue #sale de la condicional pero no termina la secuencia del código.
-
-        print("Imported file:", file) # imprime el nombre del archivo.
-        print("Imported object names:", [obj.name for obj in imported_objects]) # imprime el nombre de los objetos que contiene el archivo.
+    return tile_collection, imported_collection
 
-        for imported_object in imported_objects: # de manera de bucle recibe el objeto
-            imported_file_name = imported_object.name # del objeto recibido por el bucle se guarda el nombre en la variable "imported_file_name"
-
-            suffix = 1 # genera un nombre unico para que se eviten conflictos en un futuro.
-            unique_name = imported_file_name
+def import_gltf_files(directory, use_cache=True, workers=None): #!función que importa archivos GTLF o GLB desde un directorio especifico de Blender (se utiliza en DREAM_TEXTURES.py)
+    #? GTLF (GL Transmission Format) = formato de archivo de texto basado en JSON que almacena información del modelado 3D (geometría, texturas, animaciones, etc).
+    #? GLB (GL Binary): variante binaria del GTLF, pero este almacena los datos del modelo 3D y sus recursos(texturas, imagenes, etc) en un solo archivo binario. 
+      
+    #? listdir = funcion de Python para obtener una lista de nombres de archivos y directorios contenidos en una ruta especifica.
+    files = os.listdir(directory)
 
-            new_object_name = imported_file_name.replace(".", "_") # reemplaza los puntos (".") por barra baja ("_") en el nombre del objeto.
+    #? lower = convierte todos los caracteres de la cadena a minusculas.
+    #? endswith = verifica si la cadena termina con un sufijo o conjutno de sufijos especificos.
+    gltf_files = [file for file in files if file.lower().endswith(('.gltf', '.glb'))] # Filtra los archivos según su formato (.gltf o .glb) y los guarda en un arreglo.
 
-            imported_object.name = new_object_name # renombra el objeto importado con el nombre modificado
+    # Pre-escaneo sin bpy (solo el JSON de cada archivo): descarta los archivos dañados y ordena del más costoso al menos costoso
+    gltf_scan = bpy.data.texts["gltf_scan.py"].as_module()
+    reports, bad_reports = gltf_scan.plan_imports([gltf_scan.scan_file(os.path.join(directory, file), TILEABLE_KEYWORDS) for file in gltf_files])
+    for report in bad_reports:
+        print("Warning: Skipping unreadable file:", report["file"], report["error"])
+    if QUARANTINE_BAD_GLTF:
+        gltf_scan.quarantine(bad_reports, directory)
+    gltf_files = [report["file"] for report in reports]
+    costs = {report["path"]: report["cost"] for report in reports}
+    tileable = {report["path"]: gltf_scan.import_tileable(report) for report in reports} # el pre-escaneo ya clasificó cada archivo
+    print("[GLTF SCAN] {} files, {} tileable, {} faces".format(len(reports), sum(report["tileable"] for report in reports), sum(report["faces"] for report in reports)))
 
-            print("Original object name:", imported_file_name) # nombre original del objeto.
-            print("Modified object name:", new_object_name) # nombre modificado del objeto
+    tile_collection, imported_collection = get_import_collections()
 
-            # Check if the file name or modified object name contains specific words
-            if any(keyword in file.lower() or keyword in new_object_name.lower() for keyword in ['wall', 'ceiling', 'floor', 'tile']): # verifica si el nombre del archivo o el nombre modificado del objeto contiene palabras especificas.
-                print("This is a tileable asset") 
-                print(file)
+    workers = workers or GLTF_IMPORT_WORKERS
+    use_cache = use_cache or workers > 1 # los procesos paralelos entregan sus resultados a través de la caché.
 
-                #? unlink = permite gestionar pertenencia de los objetos a las colecciones en Blender, permitiendo agregar o quitar objetos de una coleccion sin eliminarlos de la escena.
-                for collection in imported_object.users_collection:
-                    collection.objects.unlink(imported_object) # desvincula el objeto de las colecciones a las que está vinculado.
-                #? link = vincula objetos a una colección.
-                tile_collection.objects.link(imported_object)  # vincula el objeto a la colección de azulejo.
-            else:
-                for collection in imported_object.users_collection:
-                    collection.objects.unlink(imported_object) # desvincula el objeto de las colecciones a las que está vinculado.
+    cache_dir = os.path.join(directory, GLTF_CACHE_DIR) # los assets ya procesados se guardan como librerías .blend, una por hash de archivo.
+    if use_cache and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
 
-                imported_collection.objects.link(imported_object)  # vincula el objeto a la colección de importaciones.
+    library_paths = {}
+    if use_cache:
+        for file in gltf_files:
+            file_path = os.path.join(directory, file)
+            library_paths[file_path] = os.path.join(cache_dir, gltf_file_hash(file_path) + ".blend")
 
-            print()
+    if workers > 1:
+        ingest_in_workers(library_paths, workers, costs) # después de esto, el bucle siguiente solo añade librerías.
 
-            #? transform_apply = operador de Blender que aplica las transformaciones de ubicacion, rotacion y escala de un objeto.
-            bpy.context.view_layer.objects.active = imported_object # establece elobjeto activo en la capa de vista actual, el cual asegura de que las operaciones sean para él.
-            bpy.ops.object.transform_apply(location=False, rotation=False, scale=True) # aplica la transformación de escala al objeto activo.
-            #Significa que cualquier escala no uniforme que se haya aplicado al objeto se convertirá en una escala uniforme de 1. en los ejes X, Y, Z.
+    # por cada archivo .GLTF o .GLB se realiza una importación
+    for file in gltf_files: #gtlf es el arreglo donde se guardaran los archivos con extensión gtlf y glb encontrados en la ruta especificada.
+        file_path = os.path.join(directory, file) # une el directorio con el nombre del archivo para crear una ruta completa
+        import_gltf_asset(file_path, tile_collection, imported_collection, library_paths.get(file_path), tileable[file_path])
 
-            #? material_slots = son espacios reservados en un objeto donde se pueden asignar y administrar los materiales que se aplicarán a las partes individuales del objeto.
-            #? material = material especifico asignado a un objeto.
-            #? use_nodes = propiedad del material que indica si el material utiliza nodos para su configuracion. 
-            for slot in imported_object.material_slots:
-                material = slot.material
-                material.use_nodes = True  # edición con nodos permitida.
-                for node in material.node_tree.nodes:
-                    node.select = False  # deselecciona cada nodo del arbol de nodos, preparandolos para futuras modificaciones.
+    # las copias de un mismo prop pasan a compartir una sola malla: UV, segmentación y texturas se hacen una vez por malla
+    deduplicate_meshes(list(tile_collection.objects) + list(imported_collection.objects))
 
     return tile_collection, imported_collection  # retorna las colecciones creadas en esta función.
 
-def export(output_dir): #!exportar objetos de la escena en formato gITF
+def export(output_dir, objects=None, image_names=()): #!exportar objetos de la escena en formato gITF (o solo "objects", si se indica; entonces la limpieza se limita a ellos y a "image_names")
     file_format = 'GLTF_SEPARATE'  # generar archivos gITF separados por objetos.
 
     #? path.join = une diferentes partes de una ruta o archivo
@@ -165,8 +480,11 @@ def export(output_dir): #!exportar objetos de la escena en formato gITF
         #? makedirs = crea los directorios intermedios necesarios para la ruta.
         os.makedirs(export_dir) 
 
-    objects = bpy.context.scene.objects # obtiene todos los objetos de la escena actual y los asigna a la variable "objects".
-    cleanup() # limpia y prepara la escena antes de exportar.
+    if objects is None:
+        objects = bpy.context.scene.objects # obtiene todos los objetos de la escena actual y los asigna a la variable "objects".
+        cleanup() # limpia y prepara la escena antes de exportar.
+    else:
+        cleanup_objects(objects, image_names) # otros assets pueden estar a mitad de proceso: sus mapas de segmentación y el ControlNet se conservan.
 
     for obj in objects:
         if obj.type == 'MESH': # si el ripo de objeto es una malla
@@ -451,21 +769,22 @@ def revert_metallic_value(previous_value): #! revierte el valor del canal "Metal
     else: # si el material no existe o si no está en el árbol de nodos.
         print("Material or its node tree does not exist.")
 
-def select_all_meshes(): #! selecciona todas las mallas "MESH"
+def select_all_meshes(objects=None): #! selecciona todas las mallas "MESH" de "Tileable Objects" (o de "objects", si se indica)
 
     bpy.ops.object.select_all(action='DESELECT') # deselecciona todos los objetos
 
-    collection = bpy.data.collections.get("Tileable Objects") # obtiene las colección llamada "Tileable Objects"
+    if objects is None:
+        collection = bpy.data.collections.get("Tileable Objects") # obtiene las colección llamada "Tileable Objects"
+        objects = collection.objects if collection is not None else [] # verifica si la colección no está vacía
 
-    if collection is not None: # verifica si la colección no está vacía
-        # Select all mesh objects in the collection
-        for obj in collection.objects: # itera  sobre los objetos de la colección.
-            if obj.type == 'MESH': # verifica que los objetos sean tipo "MESH"
-                obj.select_set(True) # selecciona el objeto.
+    # Select all mesh objects in the collection
+    for obj in objects: # itera  sobre los objetos de la colección.
+        if obj.type == 'MESH': # verifica que los objetos sean tipo "MESH"
+            obj.select_set(True) # selecciona el objeto.
 
-def select_image_texture_node(): #! selecciona y establece como nodo activo el primer nodo de textura de imagen encontrado en el árbol de nodos del material activo de un objeto seleccionado de malla en la escena.
+def select_image_texture_node(objects=None): #! selecciona y establece como nodo activo el primer nodo de textura de imagen encontrado en el árbol de nodos del material activo de un objeto seleccionado de malla en la escena.
 
-    select_all_meshes() # llama la función "select_all_meshes" que trabajamos antes.
+    select_all_meshes(objects) # llama la función "select_all_meshes" que trabajamos antes.
 
     selected_objects = bpy.context.selected_objects # obtiene los objetos seleccionados.
 
@@ -508,12 +827,16 @@ def select_image_texture_node(): #! selecciona y establece como nodo activo el p
 
 #? deepbump.colortonormals = este operador se utiliza para generar mapas de normales a partir de texturas de imagen.
 #? mapa de normales = es una textura que se utiliza en gráficos 3d para simular detalles de relieve en una superficie sin aumentar la cantidad de poligonos del modelo 3d
-def colortonormals(): #! función encargada de aplicar el operador "deepbump.colortonormals"
-    select_image_texture_node()  # llama la función "select_image_texture_node" que trabajamos antes.
+def colortonormals(objects=None): #! función encargada de aplicar el operador "deepbump.colortonormals"
+    select_image_texture_node(objects)  # llama la función "select_image_texture_node" que trabajamos antes.
 
     selected_objects = bpy.context.selected_objects # obtiene los objetos seleccionados.
+    processed_meshes = set() # las instancias comparten malla y materiales: cada malla se procesa una sola vez.
 
     for obj in selected_objects: # itera los objetos seleccionados.
+        if obj.data.name in processed_meshes:
+            continue
+        processed_meshes.add(obj.data.name)
         # Set the currently processed object as the active object
         bpy.context.view_layer.objects.active = obj # establece el objeto actualmente procesado como objeto activo en la capa de vista actual.
 